@@ -1,3 +1,4 @@
+import os
 import sys
 from PySide.QtGui import *
 from PySide.QtCore import *
@@ -10,6 +11,7 @@ class AppMainWindow(QMainWindow):
     update_progress = Signal(int)
     process_finished = Signal(bool)
     update_track_progress = Signal(str, int)
+    image_replaced = Signal(object)
     mw_exiting = Signal()
 
     def __init__(self, parent=None):
@@ -19,15 +21,25 @@ class AppMainWindow(QMainWindow):
 
         self.file_menu = QMenu('File')
         self.file_menu.addAction('Load', self.load_image)
-        self.file_menu.addAction('Save', self.do_nothing)
+        self.file_menu.addAction('Save', self.save_image)
 
         self.edit_menu = QMenu('Edit')
+        self.edit_menu.addAction('Undo', self.cwidg.controller.do_undo).setShortcut(QKeySequence.Undo)
+        self.edit_menu.addAction('Redo', self.cwidg.controller.do_redo).setShortcut(QKeySequence.Redo)
+        self.edit_menu.addSeparator()
         self.edit_menu.addAction('Brightness', self.get_brightness)
         self.edit_menu.addAction('Contrast', self.get_contrast)
-        self.edit_menu.addAction('Blur (Uniform)', self.cwidg.controller.do_uniform_blur)
-        self.edit_menu.addAction('Blur (Median)', self.cwidg.controller.do_median_blur)
+        self.edit_menu.addAction('Gamma', self.get_gamma)
+        self.edit_menu.addAction('Invert', self.cwidg.controller.do_invert)
+        self.edit_menu.addAction('Auto Levels', self.cwidg.controller.do_auto_levels)
+        self.edit_menu.addAction('Equalize', self.cwidg.controller.do_equalize)
+        self.edit_menu.addAction('Blur (Uniform)', self.get_uniform_radius)
+        self.edit_menu.addAction('Blur (Median)', self.get_median_radius)
+        self.edit_menu.addAction('Blur (Gaussian)', self.get_gaussian_sigma)
         self.edit_menu.addAction('Sharpen', self.cwidg.controller.do_sharpen)
         self.edit_menu.addAction('Edge Detection', self.cwidg.controller.do_edge_detection)
+        self.edit_menu.addSeparator()
+        self.edit_menu.addAction('Cancel Filters', self.cwidg.controller.cancel_filters)
 
         self.menu_bar = QMenuBar()
         self.menu_bar.addMenu(self.file_menu)
@@ -46,6 +58,7 @@ class AppMainWindow(QMainWindow):
         self.update_progress.connect(self.progressBar.setValue)
         self.process_finished.connect(self.finish_track_progress)
         self.update_track_progress.connect(self.do_track_progress_update)
+        self.image_replaced.connect(self.recycle_image)
 
         self.statusBar = QStatusBar()
         self.statusBar.addWidget(self.progress)
@@ -64,6 +77,9 @@ class AppMainWindow(QMainWindow):
         self.progressLabel.setText(name)
         self.progressBar.setRange(0, length)
 
+    def recycle_image(self, image):
+        self.cwidg.controller.recycle(image)
+
     def finish_track_progress(self, success):
         if success:
             self.statusBar.hide()
@@ -76,7 +92,15 @@ class AppMainWindow(QMainWindow):
                                                "",
                                                "Image Files (*.png *.jpg *.bmp)")[0]
         if (fileName):
-            self.cwidg.controller.do_load_image(QImage(fileName))
+            self.cwidg.controller.do_load_file(fileName)
+
+    def save_image(self):
+        fileName = QFileDialog.getSaveFileName(self,
+                                               "Save Image",
+                                               "",
+                                               "Image Files (*.png *.jpg *.bmp)")[0]
+        if (fileName):
+            self.cwidg.controller.do_save_image(fileName)
 
     def get_brightness(self):
         amount, success = QInputDialog.getInt(self, "Adjust Brightness", "Please input the desired brightness amount.")
@@ -88,6 +112,26 @@ class AppMainWindow(QMainWindow):
         if success:
             self.cwidg.controller.do_change_contrast(amount)
 
+    def get_gamma(self):
+        amount, success = QInputDialog.getDouble(self, "Adjust Gamma", "Please input the desired gamma.", 1.0, 0.1, 10.0, 2)
+        if success:
+            self.cwidg.controller.do_change_gamma(amount)
+
+    def get_uniform_radius(self):
+        radius, success = QInputDialog.getInt(self, "Uniform Blur", "Please input the blur radius.", 1, 1, 500)
+        if success:
+            self.cwidg.controller.do_uniform_blur(radius)
+
+    def get_median_radius(self):
+        radius, success = QInputDialog.getInt(self, "Median Blur", "Please input the blur radius.", 1, 1, 100)
+        if success:
+            self.cwidg.controller.do_median_blur(radius)
+
+    def get_gaussian_sigma(self):
+        sigma, success = QInputDialog.getDouble(self, "Gaussian Blur", "Please input the blur sigma.", 1.0, 0.1, 100.0, 1)
+        if success:
+            self.cwidg.controller.do_gaussian_blur(sigma)
+
     def do_nothing(self):
         pass
 
@@ -105,7 +149,8 @@ class AppCentralWidget(QWidget):
         self.ui.horizontalScrollBar.setMinimum(0)
         self.ui.horizontalScrollBar.setMaximum(2048)
         self.controller = Controller(self.ui.w_drawWidg)
-        self.model = Model(self.ui.w_drawWidg, self.controller)
+        # SHAPE_COLUMNS=1 keeps the shapes in numpy columns, for huge scenes
+        self.model = Model(self.ui.w_drawWidg, self.controller, columnar=bool(os.environ.get('SHAPE_COLUMNS')))
         self.ui.w_drawWidg.set_controller(self.controller)
         self.ui.w_drawWidg.set_model(self.model)
         self.ui.pb_color.clicked.connect(self.pick_color)
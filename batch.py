@@ -0,0 +1,105 @@
+'''Applies the same edits to many images without opening a window, spread
+over a pool of worker processes. Edits use the pipeline.parse spec and the
+same filters as the Edit menu.
+
+    python batch.py "brightness=10,contrast=20,sharpen" photos/ 'scans/*.png' -o out/
+
+Every finished file is reported with its time as soon as it is written.
+Images are only read and written through QImage, which works without a
+QApplication, so no display or X server is needed. Nothing here may create
+a QApplication or a widget, Qt 4 has no offscreen platform to fall back on.'''
+import os
+import sys
+import glob
+import time
+import argparse
+import multiprocessing
+from PySide.QtGui import QImage
+import imaging
+import pipeline
+
+EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+def find_images(paths):
+    '''the image files in paths, which are files, directories or globs'''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(os.listdir(path))
+            files.extend(os.path.join(path, n) for n in names if n.lower().endswith(EXTENSIONS))
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            files.extend(sorted(glob.glob(path)))
+    return files
+
+
+def output_path(path, out_dir, suffix=None):
+    name = os.path.basename(path)
+    if suffix:
+        name = os.path.splitext(name)[0] + suffix
+    return os.path.join(out_dir, name)
+
+
+def process(task):
+    '''runs in a worker, returns (path, out_path, pixels, seconds, error)'''
+    path, out_path, stages = task
+    start = time.time()
+    try:
+        image = QImage(path)
+        if image.isNull():
+            raise IOError('can not read %s' % path)
+        image = image.convertToFormat(QImage.Format_ARGB32)
+        out = pipeline.run(imaging.color_array(image), stages)
+        imaging.write_color(image, out)
+        if not image.save(out_path):
+            raise IOError('can not write %s' % out_path)
+        return path, out_path, image.width()*image.height(), time.time() - start, None
+    except Exception, e:
+        return path, out_path, 0, time.time() - start, str(e)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('spec', help='edits, like "brightness=10,contrast=20,sharpen"')
+    parser.add_argument('inputs', nargs='+', help='image files, directories or globs')
+    parser.add_argument('-o', '--output', required=True, help='directory for the results')
+    parser.add_argument('-j', '--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--suffix', help='save as this type instead, like .png')
+    opts = parser.parse_args(argv)
+
+    try:
+        stages = pipeline.parse(opts.spec).stages()
+    except ValueError, e:
+        parser.error(str(e))
+    files = find_images(opts.inputs)
+    if not files:
+        parser.error('no images found')
+    if not os.path.isdir(opts.output):
+        os.makedirs(opts.output)
+
+    tasks = [(f, output_path(f, opts.output, opts.suffix), stages) for f in files]
+    pool = multiprocessing.Pool(max(opts.workers, 1))
+    start = time.time()
+    failed = 0
+    pixels = 0
+    try:
+        for path, out_path, size, seconds, error in pool.imap_unordered(process, tasks):
+            if error:
+                failed += 1
+                print >> sys.stderr, '%s failed: %s' % (path, error)
+            else:
+                pixels += size
+                print '%s -> %s %.3fs' % (path, out_path, seconds)
+            sys.stdout.flush()
+    finally:
+        pool.terminate()
+    wall = time.time() - start
+    print >> sys.stderr, '%d images, %d failed, %.1fs, %.1f megapixels/s' % (
+        len(files), failed, wall, pixels/wall/1e6 if wall else 0)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
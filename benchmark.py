@@ -0,0 +1,173 @@
+'''Times the image filters without opening a window and prints the results
+as JSON. Every filter runs on synthetic images of each size with each
+backend, and is checked against the per pixel reference implementation in
+controller.Pixel_Filters on a small image first, so a speedup can never
+change results silently.
+
+    python benchmark.py --sizes 256,1k --backends direct,tiled -o bench.json
+
+Peak memory is the resident set high water mark of this process during the
+run, the tile pool workers are not included. Like batch.py it only uses
+QImage, so it runs without a display.'''
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from PySide.QtGui import QImage
+from controller import Pixel_Filters
+import imaging
+import lut
+import tiling
+import pipeline
+import telemetry
+
+SIZES = {
+    '256': 256,
+    '1k': 1024,
+    '4k': 4096,
+    '8k': 8192,
+}
+
+# name: (func, args, kwargs, reference) where reference is a list of
+# (Pixel_Filters method name, args, kwargs) passes, or None
+FILTERS = {
+    'brightness': (lut.apply, (lut.brightness(20),), {},
+                   [('spacial_filter', ([0, 0, 0, 0, 1, 0, 0, 0, 0],), {'offset': 20})]),
+    'contrast': (lut.apply, (lut.contrast(20.0),), {},
+                 [('contrast_operation', (20.0,), {})]),
+    'gamma': (lut.apply, (lut.gamma(1.5),), {}, None),
+    'invert': (lut.apply, (lut.invert(),), {}, None),
+    'sharpen': (imaging.convolve, (imaging.SHARPEN,), {'scale': 2},
+                [('spacial_filter', (imaging.SHARPEN,), {'scale': 2})]),
+    'uniform_blur': (imaging.box_blur, (1,), {},
+                     [('spacial_filter', (imaging.UNIFORM,), {'scale': 9})]),
+    'uniform_blur_r50': (imaging.box_blur, (50,), {}, None),
+    'median_blur': (imaging.median, (1,), {},
+                    [('median_filter', (), {})]),
+    'median_blur_r15': (imaging.median, (15,), {}, None),
+    'gaussian_blur': (imaging.gaussian, (2.0,), {}, None),
+    'gaussian_blur_s50': (imaging.box_gaussian, (50.0,), {}, None),
+    'edge_detection': (imaging.edges, (), {},
+                       [('luminance_filter', (), {}), ('edge_detect_filter', (), {})]),
+    'pipeline': (pipeline.run, (pipeline.Pipeline().brightness(10).contrast(20).sharpen().stages(),), {}, None),
+}
+
+BACKENDS = ('direct', 'tiled')
+
+# side of the image the per pixel reference runs on
+REFERENCE_SIZE = 48
+
+
+def synthetic(size, seed=0):
+    '''a smooth gradient with noise and a few hard edges, so every filter
+    has something to do'''
+    rng = np.random.RandomState(seed)
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32)/size
+    img = np.empty((size, size, 3), dtype=np.float32)
+    img[..., 0] = 255*x
+    img[..., 1] = 255*y
+    img[..., 2] = 127.5*(1 + np.sin(12*np.pi*x*y))
+    img[(x*8).astype(int) % 2 == (y*8).astype(int) % 2] *= 0.5
+    img += rng.normal(0, 12, img.shape)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def to_qimage(src):
+    img = QImage(src.shape[1], src.shape[0], QImage.Format_ARGB32)
+    return imaging.write_color(img, src)
+
+
+def reference(src, passes):
+    '''runs Pixel_Filters methods over every pixel, the way the app used to'''
+    filters = Pixel_Filters()
+    h, w = src.shape[:2]
+    for name, args, kwargs in passes:
+        read_image = to_qimage(src)
+        func = getattr(filters, name)
+        out = np.empty_like(src)
+        for y in range(h):
+            for x in range(w):
+                r, g, b = func(read_image, x, y, *args, **kwargs)
+                out[y, x, imaging.RGB] = int(r), int(g), int(b)
+        src = out
+    return src
+
+
+def run_backend(backend, func, src, args, kwargs):
+    if backend == 'tiled':
+        return tiling.run(func, src, args, kwargs)
+    return func(src, *args, **kwargs)
+
+
+def check(name, backends):
+    '''compares every backend against the per pixel reference'''
+    func, args, kwargs, passes = FILTERS[name]
+    if passes is None:
+        return None
+    src = synthetic(REFERENCE_SIZE, seed=1)
+    expected = reference(src, passes)
+    return all((run_backend(b, func, src, args, kwargs) == expected).all() for b in backends)
+
+
+def bench(name, size, backend, repeat=1):
+    func, args, kwargs, passes = FILTERS[name]
+    src = synthetic(SIZES[size])
+    times = []
+    exact_peak = telemetry.reset_peak_memory()
+    for i in range(repeat):
+        start = time.time()
+        run_backend(backend, func, src, args, kwargs)
+        times.append(time.time() - start)
+    wall = min(times)
+    return {
+        'filter': name,
+        'size': size,
+        'backend': backend,
+        'pixels': src.shape[0]*src.shape[1],
+        'wall_time': wall,
+        'pixels_per_second': src.shape[0]*src.shape[1]/wall if wall else None,
+        'peak_memory': telemetry.peak_memory(),
+        'peak_memory_exact': exact_peak,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default=','.join(sorted(SIZES, key=SIZES.get)))
+    parser.add_argument('--filters', default=','.join(sorted(FILTERS)))
+    parser.add_argument('--backends', default=','.join(BACKENDS))
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--no-check', action='store_true', help='skip the reference comparison')
+    parser.add_argument('-o', '--output', help='write JSON here instead of stdout')
+    opts = parser.parse_args(argv)
+
+    sizes = opts.sizes.split(',')
+    names = opts.filters.split(',')
+    backends = opts.backends.split(',')
+    results = {'workers': tiling.workers(), 'checks': {}, 'runs': []}
+    tiling.start()
+    try:
+        for name in names:
+            if not opts.no_check:
+                results['checks'][name] = check(name, backends)
+            for size in sizes:
+                for backend in backends:
+                    run = bench(name, size, backend, opts.repeat)
+                    print >> sys.stderr, '%(filter)s %(size)s %(backend)s %(wall_time).3fs' % run
+                    results['runs'].append(run)
+    finally:
+        tiling.close()
+
+    out = open(opts.output, 'w') if opts.output else sys.stdout
+    json.dump(results, out, indent=2, sort_keys=True)
+    out.write('\n')
+    failed = [n for n, ok in results['checks'].items() if ok is False]
+    if failed:
+        print >> sys.stderr, 'results differ from the reference:', ', '.join(failed)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
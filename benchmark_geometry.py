@@ -0,0 +1,61 @@
+'''Times the Point math that hit testing, reshaping and drawing run for
+every shape, and prints nanoseconds per operation and bytes per object as
+JSON.
+
+    python benchmark_geometry.py --number 100000'''
+import sys
+import json
+import timeit
+import argparse
+from model import Point, Color, Line
+
+SETUP = 'from model import Point, Color, Line, Rectangle; ' \
+        'p = Point(3, 4); q = Point(1, 2); ' \
+        'line = Line(Color(0, 0, 0), Point(0, 0), Point(10, 10)); ' \
+        'rect = Rectangle(Color(0, 0, 0), None, 10, 5); rect.rotation = 0.5'
+
+OPERATIONS = {
+    'new': 'Point(3, 4)',
+    'add': 'p + q',
+    'sub': 'p - q',
+    'scale': 'p*2.0',
+    'div': 'p/2.0',
+    'dot': 'p.dot(q)',
+    'length': 'p.length()',
+    'eq': 'p == q',
+    'lt': 'p < q',
+    'perp': 'p.perp()',
+    'angle_between': 'p.angle_between(q)',
+    'line_hit_test': 'line.is_inside(p)',
+    'to_world': 'rect.to_world(p)',
+    'rect_hit_test': 'rect.is_inside(p)',
+}
+
+
+def object_size(obj):
+    size = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--number', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    opts = parser.parse_args(argv)
+
+    results = {'ns_per_op': {}, 'bytes_per_object': {
+        'Point': object_size(Point(3, 4)),
+        'Color': object_size(Color(0, 0, 0)),
+    }}
+    for name, stmt in sorted(OPERATIONS.items()):
+        best = min(timeit.repeat(stmt, SETUP, repeat=opts.repeat, number=opts.number))
+        results['ns_per_op'][name] = best/opts.number*1e9
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
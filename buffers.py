@@ -0,0 +1,102 @@
+'''Keeps image sized buffers that are done with, so the next filter of the
+same size can take one instead of allocating and page faulting a new one.
+Buffers are found by a key like (width, height, format), the pool holds at
+most cap bytes and drops what has not been taken again for a while.'''
+import time
+import threading
+
+# bytes of free buffers kept
+CAP = 512*2**20
+# seconds a free buffer is kept when nothing takes it
+IDLE = 10.0
+
+
+class Buffer_Pool():
+    def __init__(self, cap=CAP, idle=IDLE):
+        self.cap = cap
+        self.idle = idle
+        # key: [(buffer, nbytes, returned at, drop)], most recent last
+        self.free = {}
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def take(self, key, make):
+        '''a free buffer for key, or a new one from make()'''
+        with self.lock:
+            entries = self.free.get(key)
+            if entries:
+                buf, nbytes, returned, drop = entries.pop()
+                self.size -= nbytes
+                return buf
+        return make()
+
+    def give(self, key, buf, nbytes, drop=None):
+        '''hands buf back for others to take, drop is called if the pool
+        lets go of it instead'''
+        dropped = []
+        with self.lock:
+            while self.size + nbytes > self.cap and self.size:
+                dropped.append(self.pop_oldest())
+            if nbytes > self.cap:
+                dropped.append((buf, nbytes, time.time(), drop))
+            else:
+                self.free.setdefault(key, []).append((buf, nbytes, time.time(), drop))
+                self.size += nbytes
+        self.release(dropped)
+
+    def pop_oldest(self):
+        key = min((entries[0][2], key) for key, entries in self.free.items() if entries)[1]
+        entry = self.free[key].pop(0)
+        if not self.free[key]:
+            del self.free[key]
+        self.size -= entry[1]
+        return entry
+
+    def trim(self, age=None):
+        '''lets go of buffers free for more than age seconds, idle by
+        default, 0 for all of them'''
+        age = self.idle if age is None else age
+        now = time.time()
+        dropped = []
+        with self.lock:
+            for key in list(self.free):
+                keep = []
+                for entry in self.free[key]:
+                    if now - entry[2] >= age:
+                        dropped.append(entry)
+                        self.size -= entry[1]
+                    else:
+                        keep.append(entry)
+                if keep:
+                    self.free[key] = keep
+                else:
+                    del self.free[key]
+        self.release(dropped)
+
+    def release(self, dropped):
+        for buf, nbytes, returned, drop in dropped:
+            if drop:
+                drop(buf)
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.free.values())
+
+
+def test_buffer_pool():
+    made = []
+    dropped = []
+    make = lambda: made.append(1) or bytearray(10)
+    pool = Buffer_Pool(cap=25)
+    a = pool.take((10,), make)
+    b = pool.take((10,), make)
+    pool.give((10,), a, 10, dropped.append)
+    assert pool.take((10,), make) is a and len(made) == 2
+    pool.give((10,), a, 10, dropped.append)
+    pool.give((10,), b, 10, dropped.append)
+    pool.give((20,), bytearray(20), 20, dropped.append)
+    assert len(pool) == 1 and pool.size == 20 and dropped == [a, b]
+    pool.give((30,), bytearray(30), 30, dropped.append)
+    assert len(pool) == 0 and len(dropped) == 4
+    pool.give((10,), a, 10)
+    pool.trim(age=0)
+    assert len(pool) == 0 and pool.size == 0
@@ -1,7 +1,19 @@
 from model import Color, Point, Camera, house_lines, Image, Pixel
+import imaging
+import lut
+import tiling
+import scheduler
+import pipeline
+import preview
+import store
+import history
+import histogram
+import telemetry
+import buffers
+from scheduler import Job, Cancelled
 from PySide.QtCore import *
 from PySide.QtGui import *
-import cProfile
+import os
 import sys
 import traceback
 from math import sqrt
@@ -9,7 +21,94 @@ import numpy as np
 import time
 
 
-class Controller():
+class Pixel_Filters():
+    '''the original per pixel filters. The numpy filters in imaging and lut
+    replace them in the app, they stay as the reference to check against.'''
+    def spacial_filter(self, read_image, x, y, constants, scale=1, offset=0):
+        rtot = 0
+        gtot = 0
+        btot = 0
+        for i, e in enumerate(self.neighbors(read_image, x, y)):
+            if e:
+                rtot += e.red()*constants[i]
+                gtot += e.green()*constants[i]
+                btot += e.blue()*constants[i]
+
+        rtot = rtot/scale+offset
+        gtot = gtot/scale+offset
+        btot = btot/scale+offset
+        return self.clip(rtot, gtot, btot)
+
+    def median_filter(self, read_image, x, y):
+        r = []
+        g = []
+        b = []
+        for n in self.neighbors(read_image, x, y):
+            if n:
+                r.append(n.red())
+                g.append(n.green())
+                b.append(n.blue())
+        r.sort()
+        g.sort()
+        b.sort()
+        return r[len(r)/2], g[len(g)/2], b[len(b)/2]
+
+    def clip(self, rtot, gtot, btot):
+        rtot = max(0,   rtot)
+        rtot = min(255, rtot)
+        gtot = max(0,   gtot)
+        gtot = min(255, gtot)
+        btot = max(0,   btot)
+        btot = min(255, btot)
+        return rtot, gtot, btot
+
+    def contrast_operation(self, read_image, x, y, c):
+        p = self.pixel_at(read_image, x, y)
+        r = ((c+100.0)/100.0)**4*(p.red()-128)+128
+        g = ((c+100.0)/100.0)**4*(p.green()-128)+128
+        b = ((c+100.0)/100.0)**4*(p.blue()-128)+128
+        return self.clip(r, g, b)
+
+    def neighbors(self, read_image, x, y):
+        nw = self.pixel_at(read_image, x-1, y+1)
+        nn = self.pixel_at(read_image, x,   y+1)
+        ne = self.pixel_at(read_image, x+1, y+1)
+        ww = self.pixel_at(read_image, x-1, y)
+        cc = self.pixel_at(read_image, x,   y)
+        ee = self.pixel_at(read_image, x+1, y)
+        sw = self.pixel_at(read_image, x-1, y-1)
+        ss = self.pixel_at(read_image, x,   y-1)
+        se = self.pixel_at(read_image, x+1, y-1)
+        return nw, nn, ne, ww, cc, ee, sw, ss, se
+
+    def pixel_at(self, read_image, x, y):
+        if (x >= 0) and (x < read_image.width()) and (y >= 0) and (y < read_image.height()):
+            return QColor(read_image.pixel(x, y))
+        else:
+            return None
+
+    def edge_detect_filter(self, read_image, x, y):
+        xconstants = [-1, 0, 1,
+                      -2, 0, 1,
+                      -1, 0, 1]
+
+        xr, xg, xb = self.spacial_filter(read_image, x, y, xconstants)
+
+        yconstants = [-1, -2, -1,
+                      0,  0,  0,
+                      1,  2,  1]
+
+        yr, yg, yb = self.spacial_filter(read_image, x, y, yconstants)
+        v = sqrt(xr**2 + yr**2)
+        return self.clip(v, v, v)
+
+    def luminance_filter(self, read_image, x, y):
+        c = self.pixel_at(read_image, x, y)
+        v = (c.red() + c.green() + c.blue())/3
+        return v, v, v
+
+
+class Controller(Pixel_Filters):
     def __init__(self, view):
         self.view = view
         self.draw_mode = 'select'
@@ -26,9 +125,21 @@ class Controller():
         self.camera = Camera(2048, 2048)
         self.threeD_mode = False
         self.img_mode = False
-        self.t = None
-        self.waiters = []
+        # FILTER_TELEMETRY names a file for a JSON line per filter job
+        self.telemetry = telemetry.Telemetry(os.environ.get('FILTER_TELEMETRY'))
+        # filter results are written into the images earlier filters read
+        self.buffers = buffers.Buffer_Pool()
+        # split whole image filters over all cores, the pool is forked
+        # before the scheduler starts its thread
+        self.tiled = True
+        if self.tiled:
+            tiling.start()
+        self.scheduler = scheduler.Scheduler(telemetry=self.telemetry, idle=self.trim_buffers,
+                                             idle_after=buffers.IDLE)
         self.current_image = None
+        # show a low resolution result first, then fill it in band by band
+        self.progressive = True
+        self.history = history.History()
 
         for w in QApplication.topLevelWidgets():
             if isinstance(w, QMainWindow):
@@ -36,11 +147,8 @@ class Controller():
                 break
 
     def close_down(self):
-        if self.t:
-            self.t.quit()
-
-        for w in self.waiters:
-            w.quit()
+        self.scheduler.stop()
+        tiling.close()
         return True
 
     def update_progress(self, v):
@@ -54,6 +162,37 @@ class Controller():
             self.main_window.process_finished.emit(False)
             self.view.draw_image()
 
+    def show_partial(self, img):
+        self.view.draw_image(img)
+
+    def show_preview(self, img):
+        self.view.show_preview(img)
+
+    def process_cancelled(self):
+        # nothing failed, the progress bar just goes away
+        self.main_window.process_finished.emit(True)
+
+    def cancel_filters(self):
+        # a cancelled job stops at its next progress call, and the bands it
+        # still had queued in the pool are skipped
+        self.scheduler.cancel_all()
+
+    def record_edit(self, label, before, after):
+        self.history.record(label, before, after)
+
+    def do_undo(self):
+        '''undoes the last filter once the filters queued before are done'''
+        return self.scheduler.submit(Job('Undo', lambda job: self.step_history(self.history.undo)))
+
+    def do_redo(self):
+        return self.scheduler.submit(Job('Redo', lambda job: self.step_history(self.history.redo)))
+
+    def step_history(self, step):
+        label = step(self.view.image.qimage)
+        if label:
+            print step.__name__, label
+            self.view.draw_image(self.view.image.qimage)
+
     def color_button_hit(self, r, g, b, a):
         color = color = Color(r, g, b, a)
         if self.selected_shape:
@@ -186,167 +325,154 @@ class Controller():
         self.view.canvas.updateGL()
 
     def do_edge_detection(self):
-        img = QImage(self.view.image.qimage.width(), self.view.image.qimage.height(), QImage.Format_ARGB32)
-        img_hor = QImage(self.view.image.qimage.width(), self.view.image.qimage.height(), QImage.Format_ARGB32)
-        img_ver = QImage(self.view.image.qimage.width(), self.view.image.qimage.height(), QImage.Format_ARGB32)
-        args = (img_hor, img_ver)
-        limg = QImage(self.view.image.qimage.width(), self.view.image.qimage.height(), QImage.Format_ARGB32)
-
-        # make luminence
-        self.apply_filter('Applying luminence for edge detect',
-                          limg, self.luminance_filter)
-
-        self.apply_filter('Doing edge detect', img, self.edge_detect_filter,
-                          args=args, read_image=limg)
-
-    def edge_detect_filter(self, read_image, x, y, img_hor, img_ver):
-        xconstants = [-1, 0, 1,
-                      -2, 0, 1,
-                      -1, 0, 1]
-
-        xr, xg, xb = self.spacial_filter(read_image, x, y, xconstants)
+        self.apply_image_filter('Doing edge detect', None, imaging.edges)
 
-        yconstants = [-1, -2, -1,
-                      0,  0,  0,
-                      1,  2,  1]
+    def do_sharpen(self):
+        args = (imaging.SHARPEN,)
+        kwargs = {'scale': 2}
+        self.apply_image_filter('Doing sharpen', None, imaging.convolve, args=args, kwargs=kwargs)
 
-        yr, yg, yb = self.spacial_filter(read_image, x, y, yconstants)
-        v = sqrt(xr**2 + yr**2)
-        return self.clip(v, v, v)
+    def do_median_blur(self, radius=1):
+        self.apply_image_filter('Doing median blur', None, imaging.median, (radius,))
 
-    def luminance_filter(self, read_image, x, y):
-        c = self.pixel_at(read_image, x, y)
-        v = (c.red() + c.green() + c.blue())/3
-        return v, v, v
+    def do_uniform_blur(self, radius=1):
+        self.apply_image_filter('Doing uniform blur', None, imaging.box_blur, (radius,))
 
-    def do_sharpen(self):
-        constants = (0, -1, 0,
-                     -1, 6, -1,
-                     0, -1, 0)
-        args = (constants,)
-        kwargs = {'scale': 2}
-        img = QImage(self.view.image.qimage.width(), self.view.image.qimage.height(), QImage.Format_ARGB32)
-        self.main_window.track_progress('Doing sharpen', img.height())
-        self.apply_filter('Doing sharpen', img, self.spacial_filter, args=args, kwargs=kwargs)
-
-    def do_median_blur(self):
-        img = QImage(self.view.image.qimage.width(), self.view.image.qimage.height(), QImage.Format_ARGB32)
-        self.apply_filter('Doing median blur', img, self.median_filter)
-
-    def do_uniform_blur(self):
-        constants = (1, 1, 1,
-                     1, 1, 1,
-                     1, 1, 1)
-        args = (constants,)
-        kwargs = {'scale': 9}
-        img = QImage(self.view.image.qimage.width(), self.view.image.qimage.height(), QImage.Format_ARGB32)
-        self.apply_filter('Doing uniform blur', img, self.spacial_filter, args, kwargs)
+    def do_gaussian_blur(self, sigma):
+        if sigma > imaging.BOX_GAUSSIAN_SIGMA:
+            self.apply_image_filter('Doing gaussian blur', None, imaging.box_gaussian, (sigma,))
+        else:
+            self.apply_image_filter('Doing gaussian blur', None, imaging.gaussian, (sigma,))
 
     def do_change_contrast(self, contrast_amount_num):
         print 'changing contrast by', contrast_amount_num
-        img = QImage(self.view.image.qimage.width(), self.view.image.qimage.height(), QImage.Format_ARGB32)
-        args = (float(contrast_amount_num),)
-        self.apply_filter('Doing contrast change', img, self.contrast_operation, args, {})
+        self.do_point_operation('Doing contrast change', [lut.contrast(float(contrast_amount_num))], 'contrast')
 
     def do_change_brightness(self, brightness_amount_num):
         print 'changing brightness by', brightness_amount_num
-        constants = [0, 0, 0,
-                     0, 1, 0,
-                     0, 0, 0]
-        img = QImage(self.view.image.qimage.width(), self.view.image.qimage.height(), QImage.Format_ARGB32)
-        args = (constants,)
-        kwargs = {'offset': brightness_amount_num}
-        self.apply_filter('Doing change brightness', img, self.spacial_filter, args, kwargs)
+        self.do_point_operation('Doing change brightness', [lut.brightness(brightness_amount_num)], 'brightness')
+
+    def do_change_gamma(self, gamma):
+        self.do_point_operation('Doing gamma correction', [lut.gamma(gamma)], 'gamma')
+
+    def do_invert(self):
+        self.do_point_operation('Doing invert', [lut.invert()])
+
+    def blank_image(self, like):
+        '''a new image the size of like to write a filter result into, kept
+        in a tile store if like is one'''
+        w = like.width()
+        h = like.height()
+        if isinstance(like, store.Tile_Store):
+            return store.Tile_Store(w, h)
+        return self.buffers.take((w, h, QImage.Format_ARGB32), lambda: QImage(w, h, QImage.Format_ARGB32))
+
+    def recycle(self, image):
+        '''hands an image that is no longer shown or read to the buffer pool'''
+        if isinstance(image, QImage) and image.format() == QImage.Format_ARGB32:
+            key = (image.width(), image.height(), QImage.Format_ARGB32)
+            self.buffers.give(key, image, image.byteCount())
+
+    def recycle_replaced(self, image):
+        '''recycles an image a filter job just took off the screen. A paint
+        may still be drawing it, so it is handed over from the GUI thread,
+        which runs the recycle only once that paint is done.'''
+        self.main_window.image_replaced.emit(image)
+
+    def trim_buffers(self):
+        self.buffers.trim(0)
+        tiling.scratch.trim(0)
+        imaging.scratch.trim(0)
+
+    def histogram(self):
+        '''(4, 256) counts of the red, green, blue and luminance values of
+        the shown image, from a sample of it when it is huge'''
+        return histogram.image_histograms(self.view.image.qimage)
+
+    def do_auto_levels(self):
+        self.apply_histogram_filter('Doing auto levels', histogram.auto_levels)
+
+    def do_equalize(self):
+        self.apply_histogram_filter('Doing equalization', histogram.equalize)
+
+    def apply_histogram_filter(self, label, make_table):
+        '''queues a point operation with the table make_table returns for
+        the histogram of the image the job reads'''
+        job = Histogram_Job(self, label, None, make_table)
+        return self.scheduler.submit(job)
+
+    def do_point_operation(self, label, tables, key=None):
+        '''applies one or more lookup tables from the lut module in a single
+        pass over the image'''
+        self.apply_image_filter(label, None, lut.apply, (lut.compose(*tables),), key=key)
+
+    def edits(self):
+        '''starts recording a pipeline.Pipeline, nothing runs until it is
+        passed to apply_pipeline'''
+        return pipeline.Pipeline()
+
+    def apply_pipeline(self, edits, label='Applying edits'):
+        return self.apply_image_filter(label, None, pipeline.run, (edits.stages(),))
+
+    def do_save_image(self, file_name):
+        '''saves the shown image once the filters queued before are done'''
+        return self.scheduler.submit(Job('Saving', lambda job: self.save(self.view.image.qimage, file_name)))
+
+    def save(self, image, file_name):
+        if isinstance(image, store.Tile_Store):
+            # the image formats want the whole image at once
+            image = imaging.write_color(QImage(image.width(), image.height(), QImage.Format_ARGB32), image.read())
+        return image.save(file_name)
+
+    def do_load_file(self, file_name):
+        '''loads images bigger than store.OUT_OF_CORE_PIXELS into a tile
+        store a strip at a time where the format allows it, and the rest
+        like do_load_image'''
+        reader = QImageReader(file_name)
+        size = reader.size()
+        if size.width()*size.height() <= store.OUT_OF_CORE_PIXELS:
+            return self.do_load_image(QImage(file_name))
+        tiles = store.Tile_Store(size.width(), size.height())
+        if reader.supportsOption(QImageIOHandler.ClipRect):
+            rows = tiles.band_rows()
+            for y in range(0, size.height(), rows):
+                reader = QImageReader(file_name)
+                reader.setClipRect(QRect(0, y, size.width(), min(rows, size.height() - y)))
+                strip = reader.read().convertToFormat(QImage.Format_ARGB32)
+                tiles.write(0, y, imaging.color_array(strip))
+        else:
+            image = reader.read().convertToFormat(QImage.Format_ARGB32)
+            tiles.write(0, 0, imaging.color_array(image))
+            del image
+        self.view.image = Image(None, tiles, Point(1080, 1080), tiles.width(), tiles.height())
+        self.history.clear()
+        if self.img_mode:
+            self.view.draw_image(tiles)
 
     def do_load_image(self, open_image):
+        # the numpy filters work directly on 32 bit ARGB pixels
+        if open_image.format() != QImage.Format_ARGB32:
+            open_image = open_image.convertToFormat(QImage.Format_ARGB32)
         self.view.image = Image(None, open_image, Point(1080, 1080), open_image.width(), open_image.height())
+        self.history.clear()
         if self.img_mode:
             self.view.draw_image(open_image)
 
-    def apply_filter(self, label, write_img, func, args=(), kwargs={}, read_image=None):
-        read_image = read_image or self.view.image.qimage
-        # print write_img, self.view.image.qimage, write_img == self.view.image.qimage
-        t = Filter_Thread(self, label, range(write_img.height()),
-                          read_image, write_img, func, args, kwargs)
-        startnew = False
-        if self.t:
-            if self.t.isRunning():
-                w = Waiter(self, t)
-                self.main_window.process_finished.connect(w.wake_up)
-                self.waiters.append(w)
-            else:
-                startnew = True
-        else:
-            startnew = True
-
-        if startnew:
-            self.t = t
-            self.t.start()
-        return write_img
-
-    def spacial_filter(self, read_image, x, y, constants, scale=1, offset=0):
-        rtot = 0
-        gtot = 0
-        btot = 0
-        for i, e in enumerate(self.neighbors(read_image, x, y)):
-            if e:
-                rtot += e.red()*constants[i]
-                gtot += e.green()*constants[i]
-                btot += e.blue()*constants[i]
-
-        rtot = rtot/scale+offset
-        gtot = gtot/scale+offset
-        btot = btot/scale+offset
-        return self.clip(rtot, gtot, btot)
-
-    def median_filter(self, read_image, x, y):
-        r = []
-        g = []
-        b = []
-        for n in self.neighbors(read_image, x, y):
-            if n:
-                r.append(n.red())
-                g.append(n.green())
-                b.append(n.blue())
-        r.sort()
-        g.sort()
-        b.sort()
-        return r[len(r)/2], g[len(g)/2], b[len(b)/2]
-
-    def clip(self, rtot, gtot, btot):
-        rtot = max(0,   rtot)
-        rtot = min(255, rtot)
-        gtot = max(0,   gtot)
-        gtot = min(255, gtot)
-        btot = max(0,   btot)
-        btot = min(255, btot)
-        return rtot, gtot, btot
-
-    def contrast_operation(self, read_image, x, y, c):
-        p = self.pixel_at(read_image, x, y)
-        r = ((c+100.0)/100.0)**4*(p.red()-128)+128
-        g = ((c+100.0)/100.0)**4*(p.green()-128)+128
-        b = ((c+100.0)/100.0)**4*(p.blue()-128)+128
-        return self.clip(r, g, b)
-
-    def neighbors(self, read_image, x, y):
-        nw = self.pixel_at(read_image, x-1, y+1)
-        nn = self.pixel_at(read_image, x,   y+1)
-        ne = self.pixel_at(read_image, x+1, y+1)
-        ww = self.pixel_at(read_image, x-1, y)
-        cc = self.pixel_at(read_image, x,   y)
-        ee = self.pixel_at(read_image, x+1, y)
-        sw = self.pixel_at(read_image, x-1, y-1)
-        ss = self.pixel_at(read_image, x,   y-1)
-        se = self.pixel_at(read_image, x+1, y-1)
-        return nw, nn, ne, ww, cc, ee, sw, ss, se
-
-    def pixel_at(self, read_image, x, y):
-        # if self.view.image.qimage.valid(x, y):
-        if (x >= 0) and (x < self.view.image.fullw) and (y >= 0) and (y < self.view.image.fullh):
-            return QColor(read_image.pixel(x, y))
-        else:
-            return None
+    def apply_filter(self, label, write_img, func, args=(), kwargs={}, read_image=None,
+                     key=None, priority=scheduler.NORMAL):
+        '''queues func to run for every pixel. Without a read_image the job
+        reads whatever image is shown when it starts, so queued filters
+        build on each other. Without a write_img it writes into a blank
+        image the size of the one it reads.'''
+        job = Filter_Job(self, label, write_img, func, args, kwargs, read_image, key, priority)
+        return self.scheduler.submit(job)
+
+    def apply_image_filter(self, label, write_img, func, args=(), kwargs={}, read_image=None,
+                           key=None, priority=scheduler.NORMAL):
+        '''like apply_filter, but func takes the whole (h, w, 3) color array
+        of read_image and returns the new one'''
+        job = Image_Filter_Job(self, label, write_img, func, args, kwargs, read_image, key, priority)
+        return self.scheduler.submit(job)
 
     def toggle_background_display(self):
         self.img_mode = self.img_mode is False
@@ -413,90 +539,222 @@ class Controller():
         return ret
 
 
-class Filter_Thread(QThread):
-    def __init__(self, parent, label, yrange, read_image, write_image, func, args, kwargs):
-        QThread.__init__(self)
-        self.label = label
+class Filter_Job(Job):
+    # seconds between progress bar updates
+    PROGRESS = 0.1
+
+    def __init__(self, parent, label, write_image, func, args, kwargs, read_image=None,
+                 key=None, priority=scheduler.NORMAL):
+        Job.__init__(self, label, key=key, priority=priority)
         self.parent = parent
-        self.yrange = yrange
         self.read_image = read_image
         self.write_image = write_image
         self.func = func
         self.args = args
         self.kwargs = kwargs
-
-    def run(self):
+        # set once a partial result is on screen
+        self.shown = False
+
+    def work(self):
+        read_image = self.read_image or self.parent.view.image.qimage
+        if self.write_image is None:
+            # sized now, the image shown when the job was queued may differ
+            self.write_image = self.parent.blank_image(read_image)
+        self.record.pixels = read_image.width()*read_image.height()
+        self.last_progress = 0
         try:
-            self.parent.main_window.track_progress(self.label, self.read_image.height())
+            self.parent.main_window.track_progress(self.label, read_image.height())
             print self.label
-            start = time.time()
-            height = self.yrange[-1]
-            # rangex = range(self.read_image.width())
-            width = self.read_image.width()
-            y = 0
+            self.filter(read_image)
+            with self.record.stage('history'):
+                self.parent.record_edit(self.label, read_image, self.write_image)
+            with self.record.stage('display'):
+                self.parent.process_finished(self.write_image)
+            if self.read_image is None:
+                # the image this replaced is not shown anymore
+                self.parent.recycle_replaced(read_image)
+            print 'finished', self.label, ', '.join('%s %.3fs' % stage for stage in self.record.stages)
+        except Cancelled:
+            print 'cancelled', self.label
+            self.restore(read_image)
+            self.parent.recycle_replaced(self.write_image)
+            self.parent.process_cancelled()
+            raise
+        except:
+            print 'failed', self.label
+            self.restore(read_image)
+            self.parent.recycle_replaced(self.write_image)
+            self.parent.process_finished(None)
+            # the scheduler prints the error and records the job as failed
+            raise
+
+    def progress(self, rows):
+        '''checks for cancellation, and moves the progress bar at most
+        every PROGRESS seconds'''
+        self.check()
+        now = time.time()
+        if now - self.last_progress >= self.PROGRESS:
+            self.parent.update_progress(rows)
+            self.last_progress = now
+
+    def restore(self, read_image):
+        '''takes a partial result off the screen again'''
+        if self.shown:
+            self.parent.view.set_image(read_image)
+
+    def filter(self, read_image):
+        height = read_image.height()
+        width = read_image.width()
+        y = 0
+        with self.record.stage('pixels'):
             while y < height:
-                self.parent.update_progress(y)
+                self.progress(y)
                 x = 0
                 while x < width:
-                    fargs = (self.read_image, x, y) + self.args
+                    fargs = (read_image, x, y) + self.args
                     r, g, b = self.func(*fargs, **self.kwargs)
                     self.write_image.setPixel(x, y, QColor(r, g, b).rgb())
                     x += 1
                 y += 1
-            print 'finished'
-            end = time.time()
-            print 'took', end - start
-            self.parent.process_finished(self.write_image)
-        except:
-            etype, evalue, trace = sys.exc_info()
-            print 'ERROR:', evalue
-            traceback.print_tb(trace)
-            self.parent.process_finished(None)
 
 
-class Waiter(QThread):
-    def __init__(self, parent, next):
-        QThread.__init__(self)
-        self.next = next
-        self.parent = parent
+class Image_Filter_Job(Filter_Job):
+    # seconds between redraws while bands stream in
+    REDRAW = 0.05
+    # the view has to show less than this part of the image for it to be
+    # filtered ahead of the rest
+    VISIBLE_FRACTION = 4
+
+    def filter(self, read_image):
+        if isinstance(read_image, store.Tile_Store):
+            return self.filter_store(read_image)
+        src = imaging.color_array(read_image)
+        band = None
+        focus = None
+        if self.parent.progressive:
+            band = self.band
+            focus = self.focus
+            with self.record.stage('preview'):
+                self.show_preview(src)
+            with self.record.stage('visible'):
+                self.show_visible(src)
+        self.last_draw = time.time()
+        with self.record.stage('full'):
+            if self.parent.tiled or band:
+                out = tiling.run(self.func, src, self.args, self.kwargs, self.progress, band,
+                                 parallel=self.parent.tiled, focus=focus)
+            else:
+                out = self.func(src, *self.args, **self.kwargs)
+                self.progress(read_image.height())
+        self.check()
+        if not band:
+            with self.record.stage('write'):
+                imaging.write_color(self.write_image, out)
+
+    def filter_store(self, read_image):
+        '''streams the tiles of read_image through the filter band by band,
+        so no full size copy of the image is ever made'''
+        self.shown = True
+        self.last_draw = time.time()
+        with self.record.stage('bands'):
+            store.run(self.func, read_image, self.write_image, self.args, self.kwargs,
+                      self.progress, self.store_band, parallel=self.parent.tiled)
+
+    def store_band(self, y0, y1):
+        self.check()
+        if self.parent.progressive and time.time() - self.last_draw > self.REDRAW:
+            self.parent.show_partial(self.write_image)
+            self.last_draw = time.time()
+
+    def show_preview(self, src):
+        '''filters a small proxy of src and shows it, then fills write_image
+        with it blown up so the bands can replace it as they come in'''
+        small = preview.run(self.func, src, self.args, self.kwargs)
+        if small is None:
+            return
+        small, f = small
+        self.check()
+        img = QImage(small.shape[1], small.shape[0], QImage.Format_ARGB32)
+        self.parent.show_preview(imaging.write_color(img, small))
+        self.shown = True
+        imaging.write_color(self.write_image, preview.enlarge(small, f, src.shape))
+
+    def show_visible(self, src):
+        '''filters only the part of src that is in the view and shows it,
+        so the first full resolution pixels take as long as the screen is
+        big, not the image'''
+        h, w = src.shape[:2]
+        region = self.parent.view.visible_region(w, h)
+        rows = tiling.halo(self.func, self.args, self.kwargs)
+        if region is None or rows is None:
+            return
+        x0, y0, x1, y1 = region
+        # most of the image is in sight, the bands will cover it soon enough
+        if (x1 - x0)*(y1 - y0) > h*w/self.VISIBLE_FRACTION:
+            return
+        out = tiling.filter_band(self.func, src, y0, y1, rows, self.args, self.kwargs, x0, x1)
+        self.check()
+        if not self.shown:
+            # the rest of the view keeps showing the image as it was
+            imaging.write_color(self.write_image, src)
+        imaging.write_color(self.write_image, out, y0, x0)
+        self.parent.show_partial(self.write_image)
+        self.shown = True
+
+    def focus(self):
+        '''the middle row of the view, so the bands there are filtered next'''
+        src = self.write_image
+        region = self.parent.view.visible_region(src.width(), src.height())
+        if region is None:
+            return None
+        return (region[1] + region[3])/2
 
-    def run(self):
-        while True:
-            pass
+    def band(self, y0, y1, out):
+        imaging.write_color(self.write_image, out[y0:y1], y0)
+        if self.shown and time.time() - self.last_draw > self.REDRAW:
+            self.parent.show_partial(self.write_image)
+            self.last_draw = time.time()
 
-    def wake_up(self, success):
-        print 'waking up'
-        if success:
-            self.next.start()
-            self.parent.t = self.next
-        self.quit()
-        self.parent.waiters.remove(self)
 
+class Histogram_Job(Image_Filter_Job):
+    def __init__(self, parent, label, write_image, make_table):
+        Image_Filter_Job.__init__(self, parent, label, write_image, lut.apply, (), {})
+        self.make_table = make_table
 
-def test_image_access():
-    q = QImage('/Users/nick.pope/Downloads/Grumpy_Cat_1k.jpg')
-    rangex = range(q.width())
-    for y in range(q.height()):
-        for x in rangex:
-            q.pixel(x, y)
+    def filter(self, read_image):
+        # only known once the filters queued before are done
+        with self.record.stage('histogram'):
+            self.args = (self.make_table(histogram.image_histograms(read_image)),)
+        Image_Filter_Job.filter(self, read_image)
 
 
-def test_numpy_access():
-    q = np.zeros((1080, 1337), dtype=np.int)
-    rangex = range(1080)
-    for y in range(1337):
-        for x in rangex:
-            get_pixel(q, x, y)
+def test_failed_filter_job():
+    finished = []
 
+    class Window():
+        def track_progress(self, label, rows):
+            pass
 
-def get_pixel(q, x, y):
-    return q[x][y]
+    class Parent():
+        main_window = Window()
 
+        def update_progress(self, rows):
+            pass
 
-def main():
-    cProfile.run('test_image_access()', 'img_test')
-    cProfile.run('test_numpy_access()', 'np_test')
+        def blank_image(self, like):
+            return QImage(like.width(), like.height(), QImage.Format_ARGB32)
 
+        def recycle_replaced(self, image):
+            pass
 
-if __name__ == '__main__':
-    main()
+        def process_finished(self, image):
+            finished.append(image)
+
+    s = scheduler.Scheduler(telemetry=telemetry.Telemetry())
+    job = Filter_Job(Parent(), 'broken', None, lambda *args: 1/0, (), {}, read_image=QImage(4, 4, QImage.Format_ARGB32))
+    s.submit(job)
+    while not s.telemetry.records:
+        time.sleep(0.01)
+    assert job.state == 'failed' and s.telemetry.find('broken', 'failed') and finished == [None]
+    s.stop()
+    s.threads[0].join(1)
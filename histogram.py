@@ -0,0 +1,79 @@
+'''Histograms of an image and the lookup tables made from them. Huge images
+are sampled on a regular grid, which is plenty to place levels.'''
+import numpy as np
+import imaging
+import lut
+import store
+
+# images with more pixels are sampled down to about this many
+SAMPLE_PIXELS = 2**22
+# share of the darkest and of the brightest pixels auto levels may clip
+CLIP = 0.005
+
+
+def step(width, height, pixels=SAMPLE_PIXELS):
+    return max(1, int(np.ceil(np.sqrt(float(width*height)/pixels))))
+
+
+def sample(image, pixels=SAMPLE_PIXELS):
+    '''the (h, w, 3) colors of every n-th pixel of a QImage or
+    store.Tile_Store, at most about pixels of them. A store copies only
+    the sampled pixels out of its tiles.'''
+    n = step(image.width(), image.height(), pixels)
+    if isinstance(image, store.Tile_Store):
+        return image.read(step=n)
+    return imaging.color_array(image)[::n, ::n]
+
+
+def histograms(src):
+    '''(4, 256) counts of the red, green, blue and luminance values of the
+    (h, w, 3) array src'''
+    c = src.shape[2]
+    values = src.reshape(-1, c).astype(np.int32)
+    values += np.arange(c, dtype=np.int32)*256
+    counts = np.bincount(values.ravel(), minlength=c*256).reshape(c, 256)
+    lum = np.bincount(imaging.luminance(src).ravel(), minlength=256)
+    return np.vstack([counts[list(imaging.RGB)], lum])
+
+
+def image_histograms(image):
+    return histograms(sample(image))
+
+
+def auto_levels(hist, clip=CLIP):
+    '''a (3, 256) table stretching each channel so that clip of its pixels
+    turn black and clip turn white. Channels of a single value are left
+    alone, there is nothing to stretch.'''
+    tables = []
+    for counts in hist[:3]:
+        cdf = np.cumsum(counts)
+        low = np.searchsorted(cdf, clip*cdf[-1], side='right')
+        high = np.searchsorted(cdf, (1 - clip)*cdf[-1])
+        tables.append(lut.levels(low, high) if high > low else lut.identity())
+    return lut.per_channel(*tables)
+
+
+def equalize(hist):
+    '''a (256,) table that spreads the luminance values evenly. The same
+    table goes on every channel so colors keep their hue.'''
+    cdf = np.cumsum(hist[3]).astype(np.float64)
+    first = cdf[np.nonzero(cdf)[0][0]] if cdf[-1] else 0
+    return lut.table((cdf - first)*255.0/max(cdf[-1] - first, 1) + 0.5)
+
+
+def test_histograms():
+    src = np.zeros((30, 20, 3), dtype=np.uint8)
+    src[..., imaging.RGB[0]] = 100
+    src[:10, :, imaging.RGB[2]] = 30
+    hist = histograms(src)
+    assert hist[0, 100] == 600 and hist[1, 0] == 600 and hist[2, 30] == 200
+    assert hist[3, 43] == 200 and hist[3].sum() == 600
+    assert step(4000, 3000) == 2
+    table = auto_levels(hist)
+    assert table[imaging.RGB[2], 30] == 255
+    # red is 100 everywhere and stays so
+    assert (table[imaging.RGB[0]] == lut.identity()).all()
+    tiles = store.Tile_Store(700, 600)
+    tiles.write(0, 0, np.random.randint(0, 256, (600, 700, 3)).astype(np.uint8))
+    assert (sample(tiles, pixels=10000) == tiles.read()[::7, ::7]).all()
+    assert equalize(hist)[33] == 0 and equalize(hist)[43] == 255
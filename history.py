@@ -0,0 +1,144 @@
+'''Undo and redo for the image filters. A step keeps only the tiles a filter
+changed, as they were before it ran. Undoing swaps them with the tiles of
+the shown image, which leaves the step holding what redo needs, so both
+cost as much as the number of changed tiles and nothing is ever stored
+twice.'''
+import numpy as np
+import imaging
+import store
+
+TILE = store.TILE
+# bytes of tiles kept over all steps, the oldest steps go first
+BUDGET = 512*2**20
+STEPS = 20
+
+
+def tile_box(image, ty, tx):
+    '''(x0, y0, x1, y1) of a tile, cut short at the image border'''
+    return tx*TILE, ty*TILE, min((tx + 1)*TILE, image.width()), min((ty + 1)*TILE, image.height())
+
+
+def read_tile(image, ty, tx):
+    '''a copy of a tile of a QImage or store.Tile_Store'''
+    x0, y0, x1, y1 = tile_box(image, ty, tx)
+    if isinstance(image, store.Tile_Store):
+        return image.read(x0, y0, x1, y1)
+    return np.array(imaging.color_array(image)[y0:y1, x0:x1])
+
+
+def write_tile(image, ty, tx, colors):
+    x0, y0, x1, y1 = tile_box(image, ty, tx)
+    if isinstance(image, store.Tile_Store):
+        image.write(x0, y0, colors)
+    else:
+        imaging.write_color(image, colors, y0, x0)
+
+
+def changed_tiles(before, after):
+    '''the tiles of before that differ in after, by (ty, tx)'''
+    tiles = {}
+    for ty in range(-(-before.height()/TILE)):
+        for tx in range(-(-before.width()/TILE)):
+            old = read_tile(before, ty, tx)
+            if not np.array_equal(old, read_tile(after, ty, tx)):
+                tiles[(ty, tx)] = old
+    return tiles
+
+
+class Step():
+    def __init__(self, label, tiles):
+        self.label = label
+        self.tiles = tiles
+
+    def swap(self, image):
+        '''puts the kept tiles into image and keeps the ones they replace'''
+        for (ty, tx), colors in self.tiles.items():
+            current = read_tile(image, ty, tx)
+            write_tile(image, ty, tx, colors)
+            self.tiles[(ty, tx)] = current
+
+    def memory(self):
+        return sum(t.nbytes for t in self.tiles.values())
+
+    def __repr__(self):
+        return 'Step(%s, %s tiles)' % (self.label, len(self.tiles))
+
+
+class History():
+    def __init__(self, budget=BUDGET, steps=STEPS):
+        self.budget = budget
+        self.steps = steps
+        # oldest first
+        self.done = []
+        # most recently undone last
+        self.undone = []
+
+    def record(self, label, before, after):
+        '''remembers what changed going from image before to image after.
+        A new edit can not be followed by the redo steps from before it.'''
+        if before.width() != after.width() or before.height() != after.height():
+            self.clear()
+            return
+        self.undone = []
+        self.done.append(Step(label, changed_tiles(before, after)))
+        self.trim()
+
+    def trim(self):
+        '''drops the steps furthest from the shown image until the history
+        fits, redo steps before undo steps, so what stays is all reachable'''
+        while self.undone and self.memory() > self.budget:
+            self.undone.pop(0)
+        while self.done and (len(self.done) > self.steps or self.memory() > self.budget):
+            self.done.pop(0)
+
+    def memory(self):
+        return sum(step.memory() for step in self.done + self.undone)
+
+    def undo(self, image):
+        '''turns image back by one step in place, returns the label of the
+        step or None when there is nothing to undo'''
+        if not self.done:
+            return None
+        step = self.done.pop()
+        step.swap(image)
+        self.undone.append(step)
+        return step.label
+
+    def redo(self, image):
+        if not self.undone:
+            return None
+        step = self.undone.pop()
+        step.swap(image)
+        self.done.append(step)
+        return step.label
+
+    def clear(self):
+        self.done = []
+        self.undone = []
+
+
+def test_history():
+    src = np.random.randint(0, 256, (600, 300, 3)).astype(np.uint8)
+    image = store.Tile_Store(300, 600)
+    image.write(0, 0, src)
+    edited = store.Tile_Store(300, 600)
+    edited.write(0, 0, src)
+    edited.write(10, 300, 255 - src[300:310, 10:20])
+    h = History(steps=2)
+    h.record('invert a corner', image, edited)
+    assert [len(step.tiles) for step in h.done] == [1]
+    assert h.undo(edited) == 'invert a corner' and (edited.read() == src).all()
+    assert h.redo(edited) == 'invert a corner' and (edited.read(10, 300, 20, 310) == 255 - src[300:310, 10:20]).all()
+    h.record('nothing', edited, edited)
+    h.record('nothing', edited, edited)
+    assert len(h.done) == 2 and h.done[0].label == 'nothing'
+    h.budget = 0
+    h.record('invert a corner', image, edited)
+    assert h.done == [] and h.undo(edited) is None
+    h = History()
+    h.record('invert a corner', image, edited)
+    h.record('invert a corner', image, edited)
+    h.undo(edited)
+    h.budget = h.done[0].memory()
+    h.trim()
+    assert len(h.done) == 1 and h.undone == []
@@ -0,0 +1,573 @@
+import sys
+import time
+import numpy as np
+import buffers
+
+# QImage.Format_ARGB32 stores each pixel as one 32 bit int, so the byte order
+# in memory depends on the machine.
+if sys.byteorder == 'little':
+    COLOR = slice(0, 3)  # B, G, R
+    ALPHA = 3
+    RGB = (2, 1, 0)
+else:
+    COLOR = slice(1, 4)  # R, G, B
+    ALPHA = 0
+    RGB = (0, 1, 2)
+
+
+def image_array(qimage):
+    '''returns a (height, width, 4) uint8 view onto the pixels of a 32 bit
+    QImage. Nothing is copied, so writing to the array writes to the image.'''
+    h = qimage.height()
+    w = qimage.width()
+    line = qimage.bytesPerLine()
+    buf = np.frombuffer(qimage.bits(), dtype=np.uint8)
+    return buf[:h*line].reshape(h, line/4, 4)[:, :w]
+
+
+def color_array(qimage):
+    return image_array(qimage)[..., COLOR]
+
+
+def write_color(qimage, colors, top=0, left=0):
+    '''writes an (h, w, 3) array into qimage in one step, with full alpha,
+    with its first pixel at (left, top)'''
+    pixels = image_array(qimage)[top:top + colors.shape[0], left:left + colors.shape[1]]
+    pixels[..., COLOR] = colors
+    pixels[..., ALPHA] = 255
+    return qimage
+
+
+def as_kernel(constants):
+    '''turns constants listed in Controller.neighbors order (the first row
+    weights the pixels at y+1) into a 2d kernel indexed by [dy, dx]'''
+    k = np.asarray(constants)
+    if k.ndim == 1:
+        n = int(round(np.sqrt(k.size)))
+        k = k.reshape(n, n)
+    if k.shape[0] % 2 == 0 or k.shape[1] % 2 == 0:
+        raise ValueError('kernel size must be odd, got %s' % (k.shape,))
+    return k[::-1]
+
+
+def is_integral(*values):
+    return all(np.issubdtype(np.asarray(v).dtype, np.integer) for v in values)
+
+
+def accumulator_type(kernel, integral):
+    if not integral:
+        return np.float64
+    if np.abs(kernel).sum()*255 < 2**31:
+        return np.int32
+    return np.int64
+
+
+SHARPEN = (0, -1, 0,
+           -1, 6, -1,
+           0, -1, 0)
+
+UNIFORM = (1, 1, 1,
+           1, 1, 1,
+           1, 1, 1)
+
+
+def lookup(src, table, out):
+    '''writes table[src] into out, see the lut module for tables'''
+    if table.ndim == 1:
+        np.take(table.astype(out.dtype), src, out=out)
+    else:
+        for i in range(src.shape[2]):
+            np.take(table[i].astype(out.dtype), src[..., i], out=out[..., i])
+    return out
+
+
+# the temporaries of the filters, kept for the next call of the same size
+scratch = buffers.Buffer_Pool()
+
+
+def borrow(shape, dtype):
+    '''an uninitialized scratch array, one an earlier filter gave back when
+    there is one of that shape'''
+    dtype = np.dtype(dtype)
+    return scratch.take((shape, dtype), lambda: np.empty(shape, dtype=dtype))
+
+
+def give_back(*arrays):
+    '''hands borrowed arrays back once nothing reads them anymore'''
+    for array in arrays:
+        scratch.give((array.shape, array.dtype), array, array.nbytes)
+
+
+def pad(src, ry, rx, dtype, table=None):
+    '''a borrowed copy of src inside a margin of ry rows and rx columns of
+    zeros, with the lookup table applied on the way in'''
+    h, w = src.shape[:2]
+    padded = borrow((h + 2*ry, w + 2*rx) + src.shape[2:], dtype)
+    padded[:ry] = 0
+    padded[ry+h:] = 0
+    padded[ry:ry+h, :rx] = 0
+    padded[ry:ry+h, rx+w:] = 0
+    if table is None:
+        padded[ry:ry+h, rx:rx+w] = src
+    else:
+        lookup(src, table, padded[ry:ry+h, rx:rx+w])
+    return padded
+
+
+def convolve(src, constants, scale=1, offset=0, table=None):
+    '''applies constants to every pixel of the (h, w, c) uint8 array src.
+    Neighbors that fall outside the image are skipped, same as
+    Controller.spacial_filter. A lookup table is applied to src on the way
+    in, which saves a pass when a point operation comes first.'''
+    k = as_kernel(constants)
+    integral = is_integral(k, scale, offset)
+    acc = correlate(src, k, accumulator_type(k, integral), table)
+    out = finish(acc, scale, offset)
+    give_back(acc)
+    return out
+
+
+def correlate(src, k, dtype, table=None):
+    '''sums the neighbors of every pixel of src weighted by the 2d kernel k
+    (see as_kernel) into a borrowed array of dtype, skipping missing
+    neighbors. Separable kernels run as a row pass and a column pass, k*k
+    multiplies per pixel become 2*k.'''
+    ry = k.shape[0]/2
+    rx = k.shape[1]/2
+    h, w = src.shape[:2]
+
+    # zero padding is the same as skipping the missing neighbors
+    padded = pad(src, ry, rx, dtype, table)
+    parts = separate(k)
+    if parts is not None:
+        column, row = parts
+        rows = accumulate(row, lambda j: padded[:, j:j+w], padded.shape[:1] + src.shape[1:], dtype)
+        acc = accumulate(column, lambda i: rows[i:i+h], src.shape, dtype)
+        give_back(rows)
+    elif np.count_nonzero(k) >= FFT_WEIGHTS:
+        acc = fft_correlate(padded, k, src.shape, dtype)
+    else:
+        acc = accumulate(k, lambda (i, j): padded[i:i+h, j:j+w], src.shape, dtype)
+    give_back(padded)
+    return acc
+
+
+def accumulate(k, window, shape, dtype):
+    '''sums window(index)*weight over the weights of the 1d or 2d kernel k
+    into a borrowed array'''
+    acc = borrow(shape, dtype)
+    acc[...] = 0
+    tmp = borrow(shape, dtype)
+    for index, weight in np.ndenumerate(k):
+        if weight == 0:
+            continue
+        part = window(index[0] if k.ndim == 1 else index)
+        if weight == 1:
+            acc += part
+        else:
+            np.multiply(part, weight, out=tmp)
+            acc += tmp
+    give_back(tmp)
+    return acc
+
+
+def separate(k):
+    '''splits a rank 1 kernel into (column, row) so that k equals
+    np.outer(column, row), or returns None. Integer kernels only split into
+    integer factors, so their results do not change.'''
+    if k.shape[0] == 1 or k.shape[1] == 1 or not k.any():
+        return None
+    if is_integral(k):
+        i, j = np.argwhere(k)[0]
+        row = k[i]/reduce(gcd, k[i])
+        if (k[:, j] % row[j]).any():
+            return None
+        column = k[:, j]/row[j]
+        if (np.outer(column, row) == k).all():
+            return column, row
+        return None
+    u, s, v = np.linalg.svd(k)
+    if s[1:].max() > 1e-9*s[0]:
+        return None
+    return u[:, 0]*s[0], v[0]
+
+
+def gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return abs(a)
+
+
+# kernels with at least this many weights that are not 0 go through the
+# FFT. Fixed, so every band of an image takes the same path whichever
+# worker runs it; calibrate measures a value for another machine.
+FFT_WEIGHTS = 169
+# image rows per transform, so the transforms stay small
+FFT_BAND_ROWS = 512
+
+
+def calibrate(size=192, sizes=(3, 5, 7, 9, 11, 13, 15, 17, 21, 25)):
+    '''times correlate with and without the FFT for growing square kernels
+    on a small random image, and returns the number of weights from which
+    the FFT is faster, a value for FFT_WEIGHTS'''
+    rng = np.random.RandomState(0)
+    for n in sizes:
+        k = rng.randint(1, 4, (n, n))
+        padded = rng.randint(0, 256, (size + n - 1, size + n - 1, 3)).astype(np.int32)
+        shape = (size, size, 3)
+        direct = []
+        fft = []
+        for i in range(2):
+            start = time.time()
+            accumulate(k, lambda (i, j): padded[i:i+size, j:j+size], shape, np.int32)
+            direct.append(time.time() - start)
+            start = time.time()
+            fft_correlate(padded, k, shape, np.int32)
+            fft.append(time.time() - start)
+        if min(fft) < min(direct):
+            return n*n
+    return sizes[-1]**2 + 1
+
+
+def fft_size(n):
+    '''the next size up with no prime factors but 2, 3 and 5, which the FFT
+    does fastest'''
+    while True:
+        m = n
+        for p in (2, 3, 5):
+            while m % p == 0:
+                m /= p
+        if m == 1:
+            return n
+        n += 1
+
+
+def fft_correlate(padded, k, shape, dtype):
+    '''correlate for big kernels: multiplies in the frequency domain, a band
+    of rows at a time. padded is the image with the halo of zeros around it.
+    Integer results are rounded, so they come out the same as summing. The
+    result is borrowed.'''
+    h, w = shape[:2]
+    ky, kx = k.shape
+    rows = min(FFT_BAND_ROWS, h)
+    size = (fft_size(rows + ky - 1), fft_size(w + kx - 1))
+    # correlating is convolving with the kernel turned around
+    kernel = np.fft.rfft2(k[::-1, ::-1], size)
+    if padded.ndim == 3:
+        kernel = kernel[..., None]
+    integral = np.issubdtype(np.dtype(dtype), np.integer)
+    out = borrow(shape, dtype)
+    for y in range(0, h, rows):
+        n = min(rows, h - y)
+        spectrum = np.fft.rfft2(padded[y:y + n + ky - 1], size, axes=(0, 1))
+        full = np.fft.irfft2(spectrum*kernel, size, axes=(0, 1))
+        # the start of full wrapped around, the rest is the result
+        valid = full[ky - 1:ky - 1 + n, kx - 1:kx - 1 + w]
+        out[y:y + n] = np.rint(valid) if integral else valid
+    return out
+
+
+def gaussian_kernel(sigma):
+    '''normalized 1d gaussian reaching out to 3 sigma'''
+    radius = max(1, int(np.ceil(3*sigma)))
+    x = np.arange(-radius, radius + 1)
+    g = np.exp(-x*x/(2.0*sigma*sigma))
+    return g/g.sum()
+
+
+def gaussian(src, sigma, table=None):
+    '''gaussian blur, rounded to the nearest value'''
+    g = gaussian_kernel(sigma)
+    acc = correlate(src, np.outer(g, g), np.float32, table)
+    out = finish(acc, offset=0.5)
+    give_back(acc)
+    return out
+
+
+# gaussian blurs wider than this run as three box blurs
+BOX_GAUSSIAN_SIGMA = 4.0
+
+
+def box_sums(src, radius):
+    '''sum of the (2*radius+1)**2 window around every pixel, read from a
+    summed area table so the cost does not depend on the radius. Neighbors
+    outside the image count as 0. The table is uint32 and allowed to wrap,
+    the window sums still come out exact. The sums are borrowed.'''
+    h, w = src.shape[:2]
+    r = radius
+    # rows and columns of the table past the image edges repeat the first
+    # and last ones, which clamps the windows
+    sat = borrow((h + 2*r + 1, w + 2*r + 1) + src.shape[2:], np.uint32)
+    sat[:r+1] = 0
+    sat[r+1:, :r+1] = 0
+    inside = sat[r+1:r+1+h, r+1:r+1+w]
+    np.cumsum(src, axis=0, dtype=np.uint32, out=inside)
+    np.cumsum(inside, axis=1, out=inside)
+    sat[r+1:r+1+h, r+1+w:] = sat[r+1:r+1+h, r+w:r+1+w]
+    sat[r+1+h:] = sat[r+h]
+    k = 2*radius + 1
+    sums = np.subtract(sat[k:k+h, k:k+w], sat[:h, k:k+w], out=borrow(src.shape, np.uint32))
+    sums -= sat[k:k+h, :w]
+    sums += sat[:h, :w]
+    give_back(sat)
+    return sums
+
+
+def box_blur(src, radius=1, table=None, full_window=True):
+    '''mean of the (2*radius+1)**2 window around every pixel in constant
+    time per pixel. With full_window the sum is divided by the whole window
+    and rounded down, which matches the 3x3 uniform blur at radius 1.
+    Otherwise it is divided by the neighbors inside the image and rounded
+    to the nearest value, so the borders do not darken.'''
+    looked_up = None
+    if table is not None:
+        src = looked_up = lookup(src, table, borrow(src.shape, src.dtype))
+    sums = box_sums(src, radius)
+    if looked_up is not None:
+        give_back(looked_up)
+    if full_window:
+        sums //= (2*radius + 1)**2
+    else:
+        h, w = src.shape[:2]
+        counts = np.outer(valid_counts(h, radius), valid_counts(w, radius)).astype(np.uint32)
+        counts = counts.reshape(counts.shape + (1,)*(src.ndim - 2))
+        sums += counts/2
+        sums //= counts
+    out = sums.astype(np.uint8)
+    give_back(sums)
+    return out
+
+
+def box_radii(sigma, passes=3):
+    '''radii of passes box blurs that together approximate a gaussian'''
+    ideal = np.sqrt(12.0*sigma*sigma/passes + 1)
+    lower = int(ideal)
+    if lower % 2 == 0:
+        lower -= 1
+    upper = lower + 2
+    m = int(round((12.0*sigma*sigma - passes*lower*lower - 4*passes*lower - 3*passes)/(-4*lower - 4)))
+    return [(lower if i < m else upper)/2 for i in range(passes)]
+
+
+def box_gaussian(src, sigma, table=None):
+    '''approximates a gaussian blur with three box blurs, for wide blurs
+    where even a separable kernel gets slow. Borders darken the same as in
+    gaussian: the blurs run on the image inside a margin of zeros as wide
+    as all of them together, so they spread light out into the margin
+    like one zero padded kernel would, and only the image is kept.'''
+    radii = box_radii(sigma)
+    m = sum(radii)
+    h, w = src.shape[:2]
+    padded = pad(src, m, m, np.uint8, table)
+    for radius in radii:
+        area = (2*radius + 1)**2
+        sums = box_sums(padded, radius)
+        # rounded to the nearest value, as gaussian does
+        sums += area/2
+        sums //= area
+        padded[...] = sums
+        give_back(sums)
+    out = padded[m:m+h, m:m+w].copy()
+    give_back(padded)
+    return out
+
+
+def finish(acc, scale=1, offset=0):
+    '''scales, offsets and clips an accumulator back to uint8 the same way
+    the per pixel filters do before handing the result to QColor'''
+    if np.issubdtype(acc.dtype, np.integer) and is_integral(scale, offset):
+        if scale != 1:
+            acc //= scale
+        if offset:
+            acc += offset
+    else:
+        acc = np.floor(acc/float(scale) + offset)
+    return np.clip(acc, 0, 255).astype(np.uint8)
+
+
+SOBEL_X = (-1, 0, 1,
+           -2, 0, 1,
+           -1, 0, 1)
+
+SOBEL_Y = (-1, -2, -1,
+           0,  0,  0,
+           1,  2,  1)
+
+
+def luminance(src, table=None):
+    '''mean of the color channels, as the per pixel luminance_filter'''
+    if table is not None:
+        lum = lookup(src, table, np.empty(src.shape, dtype=np.int32)).sum(axis=-1, dtype=np.int32)
+    else:
+        lum = src[..., 0].astype(np.int32)
+        for i in range(1, src.shape[2]):
+            lum += src[..., i]
+    lum //= src.shape[2]
+    return lum
+
+
+def edges(src, direction=False, table=None):
+    '''edge detection in one pass: luminance, both gradients and their
+    magnitude, matching Controller.edge_detect_filter run over the output of
+    luminance_filter. As there, each gradient is clipped to 0..255 before
+    the magnitude is taken. With direction=True the angle of the unclipped
+    gradient in radians is returned as well.'''
+    lum = luminance(src, table)
+    gx = correlate(lum, as_kernel(SOBEL_X), np.int32)
+    gy = correlate(lum, as_kernel(SOBEL_Y), np.int32)
+    angle = np.arctan2(gy, gx).astype(np.float32) if direction else None
+
+    mag = np.clip(gx, 0, 255, out=gx).astype(np.float32)
+    mag *= mag
+    gy2 = np.clip(gy, 0, 255, out=gy).astype(np.float32)
+    give_back(gx, gy)
+    gy2 *= gy2
+    mag += gy2
+    mag = np.broadcast_to(finish(np.sqrt(mag, out=mag))[..., None], src.shape)
+    if direction:
+        return mag, angle
+    return mag
+
+
+def test_convolve():
+    src = np.arange(12, dtype=np.uint8).reshape(3, 4, 1)*10
+    # identity with an offset
+    assert (convolve(src, [0, 0, 0, 0, 1, 0, 0, 0, 0], offset=5) == src + 5).all()
+    # the first row of constants weights the row below
+    out = convolve(src, [0, 1, 0, 0, 0, 0, 0, 0, 0])
+    assert (out[:2] == src[1:]).all() and (out[2] == 0).all()
+    # missing neighbors are skipped, not renormalized
+    out = convolve(src, [1]*9, scale=9)
+    assert out[0, 0, 0] == (0 + 10 + 40 + 50)/9
+
+
+def test_fft_correlate():
+    src = np.random.randint(0, 256, (70, 50, 3))
+    k = np.random.randint(-3, 4, (9, 9))
+    padded = np.pad(src, ((4, 4), (4, 4), (0, 0)), 'constant')
+    direct = accumulate(k, lambda (i, j): padded[i:i+70, j:j+50], src.shape, np.int64)
+    assert (fft_correlate(padded, k, src.shape, np.int64) == direct).all()
+    k = np.random.rand(7, 5)
+    padded = np.pad(src, ((3, 3), (2, 2), (0, 0)), 'constant').astype(np.float64)
+    direct = accumulate(k, lambda (i, j): padded[i:i+70, j:j+50], src.shape, np.float64)
+    assert np.allclose(fft_correlate(padded, k, src.shape, np.float64), direct)
+
+
+def test_gaussian_borders():
+    src = np.full((60, 50, 3), 200, dtype=np.uint8)
+    below = gaussian(src, BOX_GAUSSIAN_SIGMA)
+    above = box_gaussian(src, BOX_GAUSSIAN_SIGMA + 0.1)
+    # both zero pad, so corners and edges darken alike on either side
+    assert below[30, 25, 0] == above[30, 25, 0] == 200
+    assert below[0, 0, 0] < 100 and abs(int(below[0, 0, 0]) - above[0, 0, 0]) <= 2
+    assert below[0, 25, 0] < 150 and abs(int(below[0, 25, 0]) - above[0, 25, 0]) <= 2
+
+
+# above this radius the histogram median wins over sorting windows
+MEDIAN_HISTOGRAM_RADIUS = 3
+# roughly how many window values median_window sorts at once
+BAND_VALUES = 2**24
+
+
+def valid_counts(n, radius):
+    '''for each of n positions along an axis, how many of the 2*radius+1
+    neighbors fall inside the image'''
+    i = np.arange(n)
+    return np.minimum(i + radius, n - 1) - np.maximum(i - radius, 0) + 1
+
+
+def median(src, radius=1):
+    '''median of the (2*radius+1)**2 window around every pixel of the
+    (h, w, c) uint8 array src. Neighbors outside the image are skipped and
+    even counts take the upper median, same as Controller.median_filter.'''
+    if radius < MEDIAN_HISTOGRAM_RADIUS:
+        return median_window(src, radius)
+    return median_histogram(src, radius)
+
+
+def median_window(src, radius):
+    '''selects the median out of a strided view of every window. Cheap for
+    small radii, but the work grows with the window area.'''
+    h, w, c = src.shape
+    k = 2*radius + 1
+
+    # pad with a value above any pixel, so missing neighbors sort last and
+    # the upper median of the valid ones keeps its rank
+    padded = np.empty((h + 2*radius, w + 2*radius, c), dtype=np.uint16)
+    padded.fill(256)
+    padded[radius:radius+h, radius:radius+w] = src
+    ranks = np.outer(valid_counts(h, radius), valid_counts(w, radius))/2
+    kths = np.unique(ranks)
+
+    out = np.empty_like(src)
+    band = max(1, BAND_VALUES/(w*c*k*k))
+    sy, sx, sc = padded.strides
+    for y0 in range(0, h, band):
+        y1 = min(h, y0 + band)
+        windows = np.lib.stride_tricks.as_strided(
+            padded[y0:], shape=(y1 - y0, w, c, k, k), strides=(sy, sx, sc, sy, sx))
+        windows = np.partition(windows.reshape(y1 - y0, w, c, k*k), kths, axis=-1)
+        rank = np.broadcast_to(ranks[y0:y1, :, None, None], (y1 - y0, w, c, 1))
+        out[y0:y1] = np.take_along_axis(windows, rank, axis=-1)[..., 0]
+    return out
+
+
+def median_histogram(src, radius):
+    '''constant time median (Perreault and Hebert). Keeps a histogram per
+    column and channel, slides it down one row at a time and sums the
+    columns of each window with a running total along the row, so the cost
+    per pixel does not depend on the radius. The median is found in a 16 bin
+    coarse histogram first, then only the fine bins of the coarse bins that
+    hold a median are totalled up.
+
+    Counts are uint16 and allowed to wrap, the differences of the running
+    totals are still exact while a window holds fewer than 2**16 pixels.'''
+    h, w, c = src.shape
+    chans = np.arange(c)[:, None]
+    cols = np.arange(w)[None, :]
+    fine = np.zeros((c, 256, w), dtype=np.uint16)
+    coarse = np.zeros((c, 16, w), dtype=np.uint16)
+    # running totals along the row start with a column of zeros
+    fine_total = np.zeros((16, w + 1), dtype=np.uint16)
+    coarse_total = np.zeros((c, 16, w + 1), dtype=np.uint16)
+    lo = np.maximum(np.arange(w) - radius, 0)
+    hi = np.minimum(np.arange(w) + radius, w - 1) + 1
+    col_counts = valid_counts(w, radius)
+    row_counts = valid_counts(h, radius)
+
+    def add_row(row):
+        row = row.T
+        fine[chans, row, cols] += 1
+        coarse[chans, row >> 4, cols] += 1
+
+    def remove_row(row):
+        row = row.T
+        fine[chans, row, cols] -= 1
+        coarse[chans, row >> 4, cols] -= 1
+
+    for y in range(min(radius, h)):
+        add_row(src[y])
+
+    out = np.empty_like(src)
+    for y in range(h):
+        if y + radius < h:
+            add_row(src[y + radius])
+        if y - radius - 1 >= 0:
+            remove_row(src[y - radius - 1])
+
+        # rank of the upper median among the valid neighbors, plus one
+        need = row_counts[y]*col_counts/2 + 1
+
+        np.cumsum(coarse, axis=-1, out=coarse_total[..., 1:])
+        window = np.cumsum(coarse_total[..., hi] - coarse_total[..., lo], axis=1, dtype=np.uint16)
+        cbin = np.argmax(window >= need, axis=1)
+        below = np.where(cbin > 0, window[chans, cbin - 1, cols], 0)
+
+        for ch in range(c):
+            for cb in np.unique(cbin[ch]):
+                at = np.flatnonzero(cbin[ch] == cb)
+                np.cumsum(fine[ch, cb*16:cb*16+16], axis=-1, out=fine_total[:, 1:])
+                counts = fine_total[:, hi[at]] - fine_total[:, lo[at]]
+                counts = np.cumsum(counts, axis=0, dtype=np.uint16) + below[ch, at]
+                out[y, at, ch] = cb*16 + np.argmax(counts >= need[at], axis=0)
+    return out
@@ -0,0 +1,84 @@
+'''Point operations as 256 entry lookup tables. An 8 bit output that only
+depends on the 8 bit input of the same channel can be computed once per
+possible value instead of once per pixel. A table is either a (256,) uint8
+array used for every channel, or a (3, 256) one with a row per channel in
+the memory order of imaging.color_array.'''
+import numpy as np
+from imaging import RGB
+
+VALUES = np.arange(256, dtype=np.float64)
+
+
+def table(values):
+    '''clips and truncates computed values the same way QColor does for the
+    per pixel filters'''
+    return np.clip(np.floor(values), 0, 255).astype(np.uint8)
+
+
+def identity():
+    return np.arange(256, dtype=np.uint8)
+
+
+def brightness(amount):
+    return table(VALUES + amount)
+
+
+def contrast(c):
+    '''same curve as Controller.contrast_operation'''
+    return table(((c + 100.0)/100.0)**4*(VALUES - 128) + 128)
+
+
+def gamma(g):
+    '''gamma correction, values above 1 brighten the mid tones'''
+    return table(255.0*(VALUES/255.0)**(1.0/g) + 0.5)
+
+
+def invert():
+    return table(255 - VALUES)
+
+
+def threshold(t):
+    return table(np.where(VALUES >= t, 255, 0))
+
+
+def levels(low, high):
+    '''stretches low..high to the full 0..255 range'''
+    return table((VALUES - low)*255.0/max(high - low, 1) + 0.5)
+
+
+def per_channel(r, g, b):
+    channels = [None]*3
+    for i, t in zip(RGB, (r, g, b)):
+        channels[i] = t
+    return np.vstack(channels)
+
+
+def compose(*tables):
+    '''one table that does the same as applying tables in order'''
+    result = identity()
+    for t in tables:
+        if t.ndim == 1:
+            result = t[result]
+        else:
+            result = t[np.arange(len(t))[:, None], np.broadcast_to(result, t.shape)]
+    return result
+
+
+def apply(src, t):
+    '''looks up every value of the (h, w, c) uint8 array src in t'''
+    if t.ndim == 1:
+        return t[src]
+    out = np.empty_like(src)
+    for i in range(src.shape[2]):
+        out[..., i] = t[i][src[..., i]]
+    return out
+
+
+def test_compose():
+    assert (compose(brightness(10), brightness(-10))[10:246] == identity()[10:246]).all()
+    assert (compose(invert(), invert()) == identity()).all()
+    assert compose(brightness(50), threshold(100))[60] == 255
+    rgb = per_channel(invert(), identity(), identity())
+    src = np.zeros((1, 1, 3), dtype=np.uint8)
+    assert apply(src, compose(brightness(5), rgb))[0, 0, RGB[0]] == 250
+    assert apply(src, compose(brightness(5), rgb))[0, 0, RGB[1]] == 5
@@ -1,6 +1,13 @@
+import types
+import weakref
 import numpy as np
 from math import *
 from PySide.QtGui import QColor
+import spatial
+
+
+# attributes the object to world transform is made of
+PLACEMENT = ('center', 'rotation')
 
 
 class Shape():
@@ -9,25 +16,50 @@ class Shape():
         self.center = Point(0, 0)
         self.rotation = 0
 
+    def __setattr__(self, name, value):
+        if name in PLACEMENT:
+            # the shape moved or turned, its transforms are stale
+            self.__dict__['transforms'] = {}
+        self.__dict__[name] = value
+
     def bounding_box(self):
         return BoundingBox()
 
     def is_inside(self, q):
         return False
 
+    def world_transforms(self, trans=True):
+        '''(object to world, world to object) Transform2d, built once and
+        kept until center or rotation is assigned again'''
+        pair = self.transforms.get(trans)
+        if pair is None:
+            to_world = Transform2d()
+            if trans:
+                to_world.translate(self.center)
+            to_world.rotate(self.rotation)
+            to_object = Transform2d()
+            to_object.rotate(-self.rotation)
+            if trans:
+                to_object.translate(-self.center)
+            pair = self.transforms[trans] = (to_world, to_object)
+        return pair
+
     def to_world(self, p, trans=True):
-        t = Transform2d()
-        if trans:
-            t.translate(self.center)
-        t.rotate(self.rotation)
-        return t.transform(p)
+        return self.world_transforms(trans)[0].transform(p)
 
     def to_object(self, q, trans=True):
-        t = Transform2d()
-        t.rotate(-self.rotation)
-        if trans:
-            t.translate(-self.center)
-        return t.transform(q)
+        return self.world_transforms(trans)[1].transform(q)
+
+    def to_world_points(self, points, trans=True):
+        return self.world_transforms(trans)[0].transform_points(points)
+
+    def to_object_points(self, points, trans=True):
+        return self.world_transforms(trans)[1].transform_points(points)
+
+    def world_box(self):
+        '''(x0, y0, x1, y1) in world space around everything is_inside
+        can be true for, or None when the shape has no extent yet'''
+        return bounds(self.to_world_points(self.bounding_box().corner_array()))
 
 
 class Image(Shape):
@@ -83,6 +115,17 @@ class Line(Shape):
     def to_object(self, q):
         return q
 
+    def to_world_points(self, points):
+        return np.asarray(points, dtype=float)
+
+    def to_object_points(self, points):
+        return np.asarray(points, dtype=float)
+
+    def world_box(self):
+        if not (self.p1 and self.p2):
+            return None
+        return bounds(self.to_world_points([self.p1.vec(), self.p2.vec()]))
+
     def is_inside(self, q, tolerance=4):
         if not (self.p1 and self.p2):
             return False
@@ -196,6 +239,9 @@ class Triangle(Shape):
     def points(self):
         return (self.p1, self.p2, self.p3)
 
+    def world_box(self):
+        return bounds(self.to_world_points([p.vec() for p in self.points()]))
+
     def handle_positions(self):
         return self.points()
 
@@ -230,47 +276,365 @@ class Triangle(Shape):
         return 'tri(p1=%s p2=%s p3=%s)' % (self.p1, self.p2, self.p3)
 
 
+def bounds(points):
+    '''(x0, y0, x1, y1) around an (N, 2) array of points'''
+    x0, y0 = points.min(axis=0)
+    x1, y1 = points.max(axis=0)
+    return float(x0), float(y0), float(x1), float(y1)
+
+
 class Model():
-    def __init__(self, view, controller):
-        self.shapes = []
+    def __init__(self, view, controller, columnar=False):
+        '''columnar keeps the shapes in a Shape_Columns instead of a list
+        of objects, for scenes of very many shapes'''
+        self.shapes = Shape_Columns() if columnar else []
         self.view = view
         self.controller = controller
+        # world boxes of the saved shapes, for hit tests. The columns keep
+        # their own.
+        self.index = None if columnar else spatial.Grid_Index()
+        self.saved = 0
 
     def save_shape(self, shape):
         self.shapes.append(shape)
+        if self.index is not None:
+            self.index.insert(shape, shape.world_box(), self.saved)
+            self.saved += 1
+
+    def update_shape(self, shape):
+        '''call after a saved shape was moved, resized or turned'''
+        if self.index is None:
+            if isinstance(shape, Row) and shape.columns is self.shapes:
+                self.shapes.update_box(shape.row)
+        elif shape in self.index:
+            self.index.move(shape, shape.world_box())
+
+    def shapes_at(self, q, pad=0):
+        '''the saved shapes whose world box is within pad of q, topmost
+        first. Only these can have q inside.'''
+        if self.index is None:
+            return self.shapes.shapes_at(q.x, q.y, pad)
+        return self.index.query(q.x, q.y, pad)
 
-
-class Vector():
-    def __init__(self):
-        pass
+
+def test_Model_shapes_at():
+    m = Model(None, None)
+    r = Rectangle(Color(0, 0, 0), None, 10, 5)
+    r.center = Point(100, 100)
+    t = Triangle(Color(0, 0, 0), Point(-5, -5), Point(5, -5), Point(0, 5))
+    t.center = Point(102, 100)
+    m.save_shape(r)
+    m.save_shape(t)
+    m.save_shape(Line(Color(0, 0, 0), Point(0, 0), Point(10, 0)))
+    assert m.shapes_at(Point(101, 100)) == [t, r]
+    assert m.shapes_at(Point(91, 100)) == [r]
+    r.rotation = np.pi/2
+    m.update_shape(r)
+    assert m.shapes_at(Point(91, 100)) == [] and m.shapes_at(Point(100, 109)) == [r]
+    assert m.shapes_at(Point(5, 3)) == [] and m.shapes_at(Point(5, 3), pad=4)[0].type == 'line'
+
+
+# type codes of the columns
+TYPES = ('line', 'rectangle', 'square', 'ellipse', 'circle', 'triangle')
+# the fields each type keeps besides type, color, center and rotation
+FIELDS = {
+    'line': ('p1', 'p2'),
+    'rectangle': ('w', 'h'),
+    'square': ('size',),
+    'ellipse': ('w', 'h'),
+    'circle': ('radius',),
+    'triangle': ('p1', 'p2', 'p3'),
+}
+# column of the extent array and of the points array each field is in
+EXTENT = {'w': 0, 'h': 1, 'size': 0, 'radius': 0}
+POINTS = {'p1': 0, 'p2': 1, 'p3': 2}
+
+
+class Row():
+    '''a shape whose fields live in a row of a Shape_Columns. Comes
+    before the shape class in the bases, so the shape methods work on the
+    row unchanged. Only the columns and the row number are kept here.
+
+    Every read of a field makes a new Point or Color from the columns, so
+    changing one in place, like row.center.x = 5, is lost. Assign the
+    whole field instead: row.center = Point(5, row.center.y).'''
+    def __init__(self, columns, row):
+        self.__dict__['columns'] = columns
+        self.__dict__['row'] = row
+        self.__dict__['transforms'] = {}
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self.columns.get(self.row, name)
+
+    def __setattr__(self, name, value):
+        if name in PLACEMENT:
+            self.__dict__['transforms'] = {}
+        self.columns.set(self.row, name, value)
+
+    def detach(self):
+        '''a plain shape object with the fields of the row'''
+        shape = types.InstanceType(SHAPE_CLASSES[self.type])
+        for name in ('type', 'color', 'center', 'rotation') + FIELDS[self.type]:
+            setattr(shape, name, getattr(self, name))
+        return shape
+
+    def __deepcopy__(self, memo):
+        return self.detach()
+
+
+class Line_Row(Row, Line):
+    pass
+
+
+class Rectangle_Row(Row, Rectangle):
+    pass
+
+
+class Square_Row(Row, Square):
+    pass
+
+
+class Ellipse_Row(Row, Ellipse):
+    pass
+
+
+class Circle_Row(Row, Circle):
+    pass
+
+
+class Triangle_Row(Row, Triangle):
+    pass
+
+
+SHAPE_CLASSES = dict(zip(TYPES, (Line, Rectangle, Square, Ellipse, Circle, Triangle)))
+ROW_CLASSES = dict(zip(TYPES, (Line_Row, Rectangle_Row, Square_Row, Ellipse_Row, Circle_Row, Triangle_Row)))
+
+
+class Shape_Columns():
+    '''the saved shapes as numpy arrays with a row per shape, about a tenth
+    of the memory of shape objects. Reads as a list of Row proxies, which
+    are made on access and live only as long as something holds them.
+    Unset fields are stored as nan and read back as None, colors as the
+    float r, g, b, a they were given.'''
+    def __init__(self, capacity=1024):
+        self.count = 0
+        self.kind = np.zeros(capacity, dtype=np.int8)
+        self.rgba = np.zeros((capacity, 4))
+        self.center = np.zeros((capacity, 2))
+        self.rotation = np.zeros(capacity)
+        self.extent = np.zeros((capacity, 2))
+        self.points = np.zeros((capacity, 3, 2))
+        # (x0, y0, x1, y1) world boxes, nan when a shape has none
+        self.boxes = np.zeros((capacity, 4))
+        self.proxies = weakref.WeakValueDictionary()
+
+    def grow(self):
+        for name in ('kind', 'rgba', 'center', 'rotation', 'extent', 'points', 'boxes'):
+            old = getattr(self, name)
+            new = np.zeros((len(old)*2,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def append(self, shape):
+        if shape.type not in FIELDS:
+            raise ValueError('can not keep %s shapes in columns' % shape.type)
+        if self.count == len(self.kind):
+            self.grow()
+        row = self.count
+        self.count += 1
+        self.kind[row] = TYPES.index(shape.type)
+        self.extent[row] = np.nan
+        self.points[row] = np.nan
+        for name in ('color', 'center', 'rotation') + FIELDS[shape.type]:
+            self.set(row, name, getattr(shape, name))
+        self.update_box(row)
+
+    def get(self, row, name):
+        kind = TYPES[self.kind[row]]
+        if name == 'type':
+            return kind
+        if name == 'color':
+            return Color(*self.rgba[row].tolist())
+        if name == 'center':
+            return new_point(float(self.center[row, 0]), float(self.center[row, 1]))
+        if name == 'rotation':
+            return float(self.rotation[row])
+        if name not in FIELDS[kind]:
+            raise AttributeError(name)
+        if name in EXTENT:
+            value = self.extent[row, EXTENT[name]]
+            return None if np.isnan(value) else float(value)
+        x, y = self.points[row, POINTS[name]]
+        return None if np.isnan(x) else new_point(float(x), float(y))
+
+    def set(self, row, name, value):
+        kind = TYPES[self.kind[row]]
+        if name == 'color':
+            self.rgba[row] = value.rgba()
+        elif name == 'center':
+            self.center[row] = value.vec()
+        elif name == 'rotation':
+            self.rotation[row] = value
+        elif name not in FIELDS[kind]:
+            raise AttributeError('%s shapes have no field %s' % (kind, name))
+        elif name in EXTENT:
+            self.extent[row, EXTENT[name]] = np.nan if value is None else value
+        else:
+            self.points[row, POINTS[name]] = np.nan if value is None else value.vec()
+
+    def update_box(self, row):
+        box = self[row].world_box()
+        self.boxes[row] = np.nan if box is None else box
+
+    def shapes_at(self, x, y, pad=0):
+        '''the shapes whose box is within pad of (x, y), topmost first'''
+        boxes = self.boxes[:self.count]
+        # shapes without a box compare false
+        with np.errstate(invalid='ignore'):
+            hit = (boxes[:, 0] - pad <= x) & (x <= boxes[:, 2] + pad) & \
+                  (boxes[:, 1] - pad <= y) & (y <= boxes[:, 3] + pad)
+        return [self[row] for row in np.nonzero(hit)[0][::-1]]
+
+    def world_points(self):
+        '''(N, 4, 2) world points of every row in one pass, what the view
+        draws without making proxies: the corners of rectangles and
+        squares, p1 to p3 of triangles, p1 and p2 of lines and the center
+        of ellipses and circles. Unset fields come out as nan.'''
+        n = self.count
+        kind = self.kind[:n]
+        local = np.zeros((n, 4, 2))
+        boxed = (kind == TYPES.index('rectangle')) | (kind == TYPES.index('square'))
+        w = self.extent[:n, 0]
+        h = np.where(kind == TYPES.index('square'), w, self.extent[:n, 1])
+        local[boxed, :, 0] = w[boxed, None]*[-1, 1, 1, -1]
+        local[boxed, :, 1] = h[boxed, None]*[1, 1, -1, -1]
+        pointed = (kind == TYPES.index('triangle')) | (kind == TYPES.index('line'))
+        local[pointed, :3] = self.points[:n][pointed]
+        # x' = c x - s y + cx and y' = s x + c y + cy, as world_transforms
+        c = np.cos(self.rotation[:n])[:, None]
+        s = np.sin(self.rotation[:n])[:, None]
+        world = np.empty_like(local)
+        world[:, :, 0] = c*local[:, :, 0] - s*local[:, :, 1] + self.center[:n, 0, None]
+        world[:, :, 1] = s*local[:, :, 0] + c*local[:, :, 1] + self.center[:n, 1, None]
+        # line points are kept in world space already
+        line = kind == TYPES.index('line')
+        world[line] = local[line]
+        return world
+
+    def memory(self):
+        '''bytes of the columns in use'''
+        arrays = (self.kind, self.rgba, self.center, self.rotation, self.extent, self.points, self.boxes)
+        return sum(a[:self.count].nbytes for a in arrays)
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += self.count
+        if not 0 <= row < self.count:
+            raise IndexError(row)
+        row = int(row)
+        proxy = self.proxies.get(row)
+        if proxy is None:
+            proxy = self.proxies[row] = ROW_CLASSES[TYPES[self.kind[row]]](self, row)
+        return proxy
+
+    def __iter__(self):
+        for row in range(self.count):
+            yield self[row]
+
+    def __len__(self):
+        return self.count
+
+
+def test_Shape_Columns():
+    m = Model(None, None, columnar=True)
+    r = Rectangle(Color(1, 0, 0), None, 10, 5)
+    r.center = Point(100, 100)
+    t = Triangle(Color(0, 0, 1, 0.5), Point(-5, -5), Point(5, -5), Point(0, 5))
+    t.center = Point(102, 100)
+    m.save_shape(r)
+    m.save_shape(t)
+    m.save_shape(Line(Color(0, 0, 0), Point(0, 0)))
+    assert len(m.shapes) == 3 and [s.type for s in m.shapes] == ['rectangle', 'triangle', 'line']
+    row = m.shapes[0]
+    assert row is m.shapes[0] and row.w == 10 and row.center == Point(100, 100)
+    assert row.color.rgba() == (1, 0, 0, 1) and m.shapes[1].color.rgba() == (0, 0, 1, 0.5)
+    row.color = Color(0.3, 0.1, 0.7)
+    assert row.color.rgba() == (0.3, 0.1, 0.7, 1.0)
+    assert m.shapes[2].p2 is None and m.shapes[2].world_box() is None
+    assert m.shapes_at(Point(101, 100)) == [m.shapes[1], row]
+    assert row.is_inside(Point(91, 100)) and not m.shapes[1].is_inside(Point(91, 100))
+    row.rotation = np.pi/2
+    m.update_shape(row)
+    assert m.shapes_at(Point(91, 100)) == [] and m.shapes_at(Point(100, 109)) == [row]
+    row.center += Point(1, 0)
+    assert r.center == Point(100, 100) and m.shapes[0].center == Point(101, 100)
+    outline = row.detach()
+    assert isinstance(outline, Rectangle) and not isinstance(outline, Row) and outline.h == 5
+    assert np.allclose(outline.to_world_points([[1, 2]]), row.to_world_points([[1, 2]]))
+    for i in range(2000):
+        m.save_shape(r)
+    assert len(m.shapes) == 2003 and m.shapes[-1].center == Point(100, 100)
+    assert m.shapes.memory() < 200*len(m.shapes)
+
+
+def test_world_points():
+    columns = Shape_Columns()
+    shapes = [Rectangle(Color(1, 0, 0), None, 10, 5), Square(Color(0, 1, 0), None, 4),
+              Triangle(Color(0, 0, 1), Point(-5, -5), Point(5, -5), Point(0, 5)),
+              Ellipse(Color(0, 0, 0), Point(7, 8), 3, 2), Line(Color(0, 0, 0), Point(1, 2), Point(3, 4))]
+    for i, shape in enumerate(shapes):
+        shape.center = shape.center or Point(10*i, -i)
+        shape.rotation = 0.3*i
+        columns.append(shape)
+    columns.append(Line(Color(0, 0, 0), Point(0, 0)))
+    points = columns.world_points()
+    assert points.shape == (6, 4, 2) and np.isnan(points[5, 1]).all()
+    for row in (0, 1):
+        box = columns[row].bounding_box().corner_array()
+        assert np.allclose(points[row], columns[row].to_world_points(box))
+    tri = columns[2]
+    assert np.allclose(points[2, :3], tri.to_world_points([p.vec() for p in tri.points()]))
+    assert np.allclose(points[3], [7, 8]) and np.allclose(points[4, :2], [[1, 2], [3, 4]])
+
+
+class Vector(object):
+    '''element-wise math over vec(). Subclasses keep their fields in
+    __slots__, and Point overrides the common operations with plain float
+    math, since they run for every shape on every mouse move and frame.'''
+    __slots__ = ()
 
     def vec(self):
         return tuple()
 
     def dot(self, other):
         if isinstance(other, self.__class__):
-            return np.array(self.vec()).dot(np.array(other.vec()))
+            return sum(a * b for a, b in zip(self.vec(), other.vec()))
         else:
             print 'Cannot do dot product on type %s' % other.__class__
             return None
 
     def length(self):
-        return np.linalg.norm(np.array(self.vec()))
+        return sqrt(sum(a * a for a in self.vec()))
 
     def angle_between(a, b):
-        return np.arccos(a.dot(b)/(a.length() * b.length()))
+        lengths = a.length() * b.length()
+        if not lengths:
+            return float('nan')
+        return acos(max(-1.0, min(1.0, a.dot(b)/lengths)))
 
     def __neg__(self):
         return self.__class__(*[-a for a in self.vec()])
 
     def __eq__(self, other):
-        return [a == b for a, b in zip(self.vec(), other.vec())].count(False) == 0
+        return all(a == b for a, b in zip(self.vec(), other.vec()))
 
     def __lt__(self, other):
-        return [a < b for a, b in zip(self.vec(), other.vec())].count(False) == 0
+        return all(a < b for a, b in zip(self.vec(), other.vec()))
 
     def __gt__(self, other):
-        return [a > b for a, b in zip(self.vec(), other.vec())].count(False) == 0
+        return all(a > b for a, b in zip(self.vec(), other.vec()))
 
     def __sub__(self, other):
         return self.__class__(*[a - b for a, b in zip(self.vec(), other.vec())])
@@ -290,11 +654,15 @@ class Vector():
         else:
             return self.__class__(*[a / other for a in self.vec()])
 
+    __truediv__ = __div__
+
     def __repr__(self):
         return self.__class__.__name__ + '(' + ', '.join([str(i) for i in self.vec()]) + ')'
 
 
 class Point(Vector):
+    __slots__ = ('x', 'y', 'w')
+
     def __init__(self, x, y, w=1):
         self.x = float(x)
         self.y = float(y)
@@ -304,10 +672,67 @@ class Point(Vector):
         return (self.x, self.y)
 
     def vec(self):
-        return self.xy()
+        return (self.x, self.y)
 
     def perp(self):
-        return Point(self.y*-1, self.x)
+        return new_point(self.y*-1, self.x)
+
+    def dot(self, other):
+        if isinstance(other, Point):
+            return self.x*other.x + self.y*other.y
+        return Vector.dot(self, other)
+
+    def length(self):
+        return sqrt(self.x*self.x + self.y*self.y)
+
+    def __neg__(self):
+        return new_point(-self.x, -self.y)
+
+    def __eq__(self, other):
+        if isinstance(other, Point):
+            return self.x == other.x and self.y == other.y
+        return Vector.__eq__(self, other)
+
+    def __lt__(self, other):
+        if isinstance(other, Point):
+            return self.x < other.x and self.y < other.y
+        return Vector.__lt__(self, other)
+
+    def __gt__(self, other):
+        if isinstance(other, Point):
+            return self.x > other.x and self.y > other.y
+        return Vector.__gt__(self, other)
+
+    def __sub__(self, other):
+        if isinstance(other, Point):
+            return new_point(self.x - other.x, self.y - other.y)
+        return Vector.__sub__(self, other)
+
+    def __add__(self, other):
+        if isinstance(other, Point):
+            return new_point(self.x + other.x, self.y + other.y)
+        return Vector.__add__(self, other)
+
+    def __mul__(self, other):
+        if isinstance(other, Point):
+            return new_point(self.x * other.x, self.y * other.y)
+        return Point(self.x * other, self.y * other)
+
+    def __div__(self, other):
+        if isinstance(other, Point):
+            return new_point(self.x / other.x, self.y / other.y)
+        return Point(self.x / other, self.y / other)
+
+    __truediv__ = __div__
+
+
+def new_point(x, y):
+    '''a Point from two floats, skipping the conversions in Point.__init__'''
+    p = object.__new__(Point)
+    p.x = x
+    p.y = y
+    p.w = 1.0
+    return p
 
 
 def test_Point():
@@ -324,6 +749,9 @@ def test_Point():
     assert Point(0, 1).angle_between(Point(1, 0)) == np.pi/2
     assert Point(0, 1).angle_between(Point(1/np.sqrt(2), 1/np.sqrt(2))) == np.pi/4
     assert Point(0, 1).angle_between(Point(0, -1)) == np.pi
+    assert Point(1, 2).perp() == Point(-2, 1)
+    assert -Point(1, 2) == Point(-1, -2) and Point(2, 4)/2 == Point(1, 2)
+    assert Color(0, 0.5, 1) == Color(0, 0.5, 1) and Color(0, 0, 0).dot(Point(1, 1)) is None
     # assert Point(1/np.sqrt(2), 1/np.sqrt(2)).length() == np.sqrt
 
 
@@ -348,6 +776,11 @@ class BoundingBox(Shape):
     def corners(self):
         return (self.tl(), self.tr(), self.br(), self.bl())
 
+    def corner_array(self):
+        '''the corners in the same order as a (4, 2) array'''
+        return np.array([[-self.w, +self.h], [+self.w, +self.h],
+                         [+self.w, -self.h], [-self.w, -self.h]], dtype=float)
+
     def is_inside(self, q):
         within_x = -self.w < q.x and q.x < self.w
         within_y = self.h > q.y and q.y > -self.h
@@ -387,6 +820,47 @@ class Transform2d():
         ret = self.M.dot(np.array([[p.x], [p.y], [p.w]], dtype=float)).reshape(-1)
         return Point(ret[0], ret[1], ret[2])
 
+    def transform_points(self, points):
+        '''an (N, 2) or (N, 3) array of points transformed in one product,
+        (N, 2) points have w=1'''
+        points = np.asarray(points, dtype=float)
+        if points.shape[1] == 2:
+            return points.dot(self.M[:2, :2].T) + self.M[:2, 2]
+        return points.dot(self.M.T)
+
+
+def test_Shape_transforms():
+    r = Rectangle(Color(0, 0, 0), None, 2, 1)
+    r.center = Point(3, 4)
+    r.rotation = 0.5
+    p = r.to_world(Point(1, 1))
+    assert (r.to_object(p) - Point(1, 1)).length() < 1e-9
+    assert r.world_transforms() is r.world_transforms()
+    assert r.world_transforms(trans=False) is not r.world_transforms()
+    first = r.world_transforms()
+    r.center += Point(1, 0)
+    assert r.world_transforms() is not first
+    assert (r.to_world(Point(1, 1)) - p - Point(1, 0)).length() < 1e-9
+    r.rotation = 0
+    assert r.to_world(Point(1, 1)) == Point(5, 5)
+
+
+def test_transform_points():
+    t = Transform2d()
+    t.translate(Point(1.0, 2.0))
+    t.rotate(0.3)
+    t.scale(2, 3)
+    points = [Point(0, 0), Point(1, 0), Point(-2.5, 4, 2)]
+    ret = t.transform_points([p.vec() + (p.w,) for p in points])
+    for p, q in zip(points, ret):
+        assert np.allclose(t.transform(p).vec() + (t.transform(p).w,), q)
+    assert np.allclose(t.transform_points([p.vec() for p in points[:2]]), ret[:2, :2])
+    r = Rectangle(Color(0, 0, 0), None, 2, 1)
+    r.center = Point(3, 4)
+    r.rotation = 1.0
+    corners = r.to_world_points(r.bounding_box().corner_array())
+    assert np.allclose(corners, [r.to_world(p).vec() for p in r.bounding_box().corners()])
+
 
 def test_Transform2d():
     t = Transform2d()
@@ -405,6 +879,8 @@ def test_Transform2d():
 
 
 class Color(Vector):
+    __slots__ = ('r', 'g', 'b', 'a')
+
     def __init__(self, r, g, b, a=1.0):
         self.r = r
         self.g = g
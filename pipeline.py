@@ -0,0 +1,157 @@
+'''Records a sequence of edits and runs them later in as few passes as
+possible. Point operations next to each other become one lookup table,
+and a table right before a convolution or edge detection is applied while
+that filter loads its input, so neither costs a pass of its own.'''
+import numpy as np
+import imaging
+import lut
+
+# filters that can take a lookup table for their input
+TAKES_TABLE = (imaging.convolve, imaging.gaussian, imaging.box_blur, imaging.box_gaussian, imaging.edges)
+
+
+class Pipeline():
+    def __init__(self):
+        self.ops = []
+
+    def point(self, table):
+        self.ops.append((lut.apply, (table,), {}))
+        return self
+
+    def brightness(self, amount):
+        return self.point(lut.brightness(amount))
+
+    def contrast(self, amount):
+        return self.point(lut.contrast(float(amount)))
+
+    def gamma(self, g):
+        return self.point(lut.gamma(g))
+
+    def invert(self):
+        return self.point(lut.invert())
+
+    def convolve(self, constants, scale=1, offset=0):
+        self.ops.append((imaging.convolve, (constants,), {'scale': scale, 'offset': offset}))
+        return self
+
+    def sharpen(self):
+        return self.convolve(imaging.SHARPEN, scale=2)
+
+    def uniform_blur(self, radius=1):
+        '''the Edit menu's uniform blur, the 3x3 one at radius 1'''
+        return self.box_blur(radius)
+
+    def box_blur(self, radius):
+        self.ops.append((imaging.box_blur, (whole(radius),), {}))
+        return self
+
+    def gaussian_blur(self, sigma):
+        if sigma > imaging.BOX_GAUSSIAN_SIGMA:
+            self.ops.append((imaging.box_gaussian, (sigma,), {}))
+        else:
+            self.ops.append((imaging.gaussian, (sigma,), {}))
+        return self
+
+    def median_blur(self, radius=1):
+        self.ops.append((imaging.median, (whole(radius),), {}))
+        return self
+
+    def edge_detection(self):
+        self.ops.append((imaging.edges, (), {}))
+        return self
+
+    def stages(self):
+        '''the recorded ops with point operations fused, as a list of
+        (func, args, kwargs)'''
+        stages = []
+        table = None
+        for func, args, kwargs in self.ops:
+            if func is lut.apply:
+                table = args[0] if table is None else lut.compose(table, args[0])
+                continue
+            if table is not None:
+                if func in TAKES_TABLE:
+                    kwargs = dict(kwargs, table=table)
+                else:
+                    stages.append((lut.apply, (table,), {}))
+                table = None
+            stages.append((func, args, kwargs))
+        if table is not None:
+            stages.append((lut.apply, (table,), {}))
+        return stages
+
+    def run(self, src):
+        return run(src, self.stages())
+
+    def __len__(self):
+        return len(self.ops)
+
+    def __repr__(self):
+        return 'Pipeline(%s)' % ', '.join(func.__name__ for func, args, kwargs in self.ops)
+
+
+# Pipeline methods a spec can name
+SPEC_OPS = ('brightness', 'contrast', 'gamma', 'invert', 'sharpen', 'uniform_blur',
+            'box_blur', 'gaussian_blur', 'median_blur', 'edge_detection')
+
+
+def whole(radius):
+    '''radius as an int, for the filters that take a window of pixels'''
+    if radius < 1 or int(radius) != radius:
+        raise ValueError('radius must be a whole number of pixels, not %s' % radius)
+    return int(radius)
+
+
+def number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def parse(spec):
+    '''builds a Pipeline from text like "brightness=10,contrast=20,sharpen",
+    where a value after = is passed to the Pipeline method of that name'''
+    p = Pipeline()
+    for op in spec.split(','):
+        name, _, value = op.strip().partition('=')
+        if name not in SPEC_OPS:
+            raise ValueError('unknown edit %r, use one of %s' % (name, ', '.join(SPEC_OPS)))
+        args = [number(v) for v in value.split(':')] if value else []
+        try:
+            getattr(p, name)(*args)
+        except (TypeError, ValueError):
+            raise ValueError('bad arguments for %s' % name)
+    return p
+
+
+def run(src, stages):
+    '''runs stages from Pipeline.stages on the (h, w, c) uint8 array src'''
+    for func, args, kwargs in stages:
+        src = func(src, *args, **kwargs)
+    return src
+
+
+def test_pipeline():
+    src = np.random.randint(0, 256, (20, 30, 3)).astype(np.uint8)
+    p = Pipeline().brightness(10).contrast(20).sharpen().invert()
+    assert [f for f, a, k in p.stages()] == [imaging.convolve, lut.apply]
+    step = lut.apply(src, lut.brightness(10))
+    step = lut.apply(step, lut.contrast(20.0))
+    step = imaging.convolve(step, imaging.SHARPEN, scale=2)
+    step = lut.apply(step, lut.invert())
+    assert (p.run(src) == step).all()
+
+
+def test_parse():
+    p = parse('brightness=10, contrast=20,sharpen,gaussian_blur=1.5')
+    assert [f for f, a, k in p.ops] == [lut.apply, lut.apply, imaging.convolve, imaging.gaussian]
+    assert p.ops[3][1] == (1.5,)
+    assert parse('uniform_blur').ops == parse('uniform_blur=1').ops == [(imaging.box_blur, (1,), {})]
+    assert parse('median_blur=2.0').ops == [(imaging.median, (2,), {})]
+    for spec in ('blur', 'sharpen=5', 'gaussian_blur', 'brightness=1:2', 'uniform_blur=1.5', 'median_blur=0'):
+        try:
+            parse(spec)
+            assert False
+        except ValueError:
+            pass
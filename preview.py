@@ -0,0 +1,89 @@
+'''Quick low resolution previews of the whole image filters. The filter runs
+on every f-th pixel of the image with its pixel sized arguments shrunk by
+f, which takes a fraction of the time and looks about the same on screen
+until the full resolution result comes in.'''
+import numpy as np
+import imaging
+import lut
+import pipeline
+
+# longest side of the proxy image, about the size of the view
+SIZE = 512
+
+
+def shrink_radius(f, radius):
+    return max(1, int(round(float(radius)/f)))
+
+
+# turns the arguments of each filter into the ones for a proxy shrunk by f
+PROXY_ARGS = {
+    imaging.convolve: lambda f, *args, **kwargs: (args, kwargs),
+    imaging.gaussian: lambda f, sigma, table=None: ((float(sigma)/f,), {'table': table}),
+    imaging.box_blur: lambda f, radius=1, table=None, full_window=True: (
+        (shrink_radius(f, radius),), {'table': table, 'full_window': full_window}),
+    imaging.box_gaussian: lambda f, sigma, table=None: ((float(sigma)/f,), {'table': table}),
+    imaging.median: lambda f, radius=1: ((shrink_radius(f, radius),), {}),
+    imaging.edges: lambda f, *args, **kwargs: (args, kwargs),
+    lut.apply: lambda f, t: ((t,), {}),
+    pipeline.run: lambda f, stages: ((proxy_stages(f, stages),), {}),
+}
+
+
+# medians sort their whole window, so their proxy shrinks until it is 3x3
+MIN_FACTOR = {
+    imaging.median: lambda radius=1: radius,
+    pipeline.run: lambda stages: max([min_factor(*stage) for stage in stages] or [1]),
+}
+
+
+def min_factor(func, args=(), kwargs={}):
+    if func not in MIN_FACTOR:
+        return 1
+    return MIN_FACTOR[func](*args, **kwargs)
+
+
+def proxy_args(f, func, args=(), kwargs={}):
+    '''(args, kwargs) for func on the proxy, or None for unknown filters'''
+    if func not in PROXY_ARGS:
+        return None
+    return PROXY_ARGS[func](f, *args, **kwargs)
+
+
+def proxy_stages(f, stages):
+    return [(func,) + proxy_args(f, func, args, kwargs) for func, args, kwargs in stages]
+
+
+def factor(shape, size=SIZE):
+    '''how many pixels of the image one proxy pixel stands for'''
+    return max(1, -(-max(shape[:2])/size))
+
+
+def shrink(src, f):
+    return np.ascontiguousarray(src[::f, ::f])
+
+
+def enlarge(small, f, shape):
+    '''blows the proxy back up to shape by repeating every pixel'''
+    return small.repeat(f, axis=0)[:shape[0]].repeat(f, axis=1)[:, :shape[1]]
+
+
+def run(func, src, args=(), kwargs={}, size=SIZE):
+    '''returns (proxy result, f), or None when src is already small enough
+    to filter directly or func is unknown'''
+    f = factor(src.shape, size)
+    if f > 1:
+        f = max(f, min_factor(func, args, kwargs))
+    proxy = proxy_args(f, func, args, kwargs)
+    if f == 1 or proxy is None:
+        return None
+    return func(shrink(src, f), *proxy[0], **proxy[1]), f
+
+
+def test_preview():
+    src = np.random.randint(0, 256, (1100, 700, 3)).astype(np.uint8)
+    stages = pipeline.Pipeline().brightness(10).median_blur(6).stages()
+    small, f = run(pipeline.run, src, (stages,))
+    assert f == 6 and small.shape == (184, 117, 3)
+    assert proxy_stages(f, stages)[1][1] == (1,)
+    assert enlarge(small, f, src.shape).shape == src.shape
+    assert run(imaging.median, src[:100, :100], (1,)) is None
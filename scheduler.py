@@ -0,0 +1,163 @@
+'''A job queue for image filters. Jobs wait on a condition variable, so
+queued jobs cost nothing until a worker picks them up.'''
+import heapq
+import itertools
+import threading
+import traceback
+import time
+import telemetry
+
+# lower runs first
+NORMAL = 1
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Job():
+    def __init__(self, label, func=None, key=None, priority=NORMAL):
+        '''func is called with the job once a worker picks it up, subclasses
+        can override work instead. Jobs with the same key supersede each
+        other while they wait in line.'''
+        self.label = label
+        self.func = func
+        self.key = key
+        self.priority = priority
+        self.state = 'new'
+        self.cancelled = False
+        self.record = telemetry.Job_Record(label)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check(self):
+        '''long running funcs call this now and then to stop early'''
+        if self.cancelled:
+            raise Cancelled(self.label)
+
+    def run(self):
+        self.state = 'running'
+        telemetry.reset_peak_memory()
+        self.record.started = time.time()
+        try:
+            self.work()
+            self.state = 'done'
+        except Cancelled:
+            self.state = 'cancelled'
+        finally:
+            self.record.finished = time.time()
+            self.record.peak_memory = telemetry.peak_memory()
+
+    def work(self):
+        self.func(self)
+
+    def __repr__(self):
+        return 'Job(%s, %s)' % (self.label, self.state)
+
+
+class Scheduler():
+    def __init__(self, workers=1, telemetry=None, idle=None, idle_after=1.0):
+        '''every job that leaves the queue is added to telemetry. idle is
+        called when a worker has found no job for idle_after seconds.'''
+        self.telemetry = telemetry
+        self.idle = idle
+        self.idle_after = idle_after
+        self.queue = []
+        self.order = itertools.count()
+        self.lock = threading.Condition()
+        self.running = []
+        self.stopping = False
+        self.threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self.work, name='filter worker %s' % i)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, job):
+        with self.lock:
+            # a job replaces the one queued right before it with the same key
+            waiting = [e for e in self.queue if e[0] == job.priority]
+            if job.key is not None and waiting:
+                last = max(waiting)[2]
+                if last.key == job.key:
+                    last.cancel()
+            job.state = 'queued'
+            job.record.queued = time.time()
+            heapq.heappush(self.queue, (job.priority, next(self.order), job))
+            self.lock.notify()
+        return job
+
+    def pending(self):
+        with self.lock:
+            return [j for p, n, j in sorted(self.queue) if not j.cancelled]
+
+    def cancel_all(self):
+        with self.lock:
+            for p, n, j in self.queue:
+                j.cancel()
+            for j in self.running:
+                j.cancel()
+
+    def stop(self):
+        self.cancel_all()
+        with self.lock:
+            self.stopping = True
+            self.lock.notify_all()
+
+    def work(self):
+        while True:
+            with self.lock:
+                while not self.queue and not self.stopping:
+                    if self.idle is None:
+                        self.lock.wait()
+                        continue
+                    self.lock.wait(self.idle_after)
+                    if not self.queue and not self.stopping and not self.running:
+                        self.idle()
+                        self.lock.wait()
+                if self.stopping:
+                    return
+                job = heapq.heappop(self.queue)[2]
+                if job.cancelled:
+                    job.state = 'cancelled'
+                    self.report(job)
+                    continue
+                self.running.append(job)
+            try:
+                job.run()
+            except:
+                traceback.print_exc()
+                job.state = 'failed'
+            finally:
+                with self.lock:
+                    self.running.remove(job)
+                self.report(job)
+
+    def report(self, job):
+        job.record.state = job.state
+        if self.telemetry is not None:
+            self.telemetry.add(job.record)
+
+
+def test_scheduler():
+    done = []
+    gate = threading.Event()
+    finished = threading.Event()
+    s = Scheduler(telemetry=telemetry.Telemetry())
+    s.submit(Job('block', lambda job: gate.wait()))
+    first = s.submit(Job('contrast 10', lambda job: done.append(10), key='contrast'))
+    s.submit(Job('contrast 20', lambda job: done.append(20), key='contrast'))
+    s.submit(Job('urgent', lambda job: done.append('urgent'), priority=NORMAL - 1))
+    s.submit(Job('sharpen', lambda job: done.append('sharpen') or finished.set()))
+    assert first.cancelled
+    gate.set()
+    finished.wait(5)
+    assert done == ['urgent', 20, 'sharpen']
+    while len(s.telemetry.records) < 5:
+        time.sleep(0.01)
+    assert [r.label for r in s.telemetry.find(state='cancelled')] == ['contrast 10']
+    assert s.telemetry.find('sharpen')[0].wait() >= 0
+    s.stop()
+    s.threads[0].join(1)
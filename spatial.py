@@ -0,0 +1,101 @@
+'''Finds the shapes under a point without looking at every shape. The world
+is cut into square cells and each shape is listed in the cells its box
+covers, so a click only looks at the shapes in the cells around it. Shapes
+covering very many cells are kept in one list that every query checks.'''
+from math import floor
+
+# side of a cell in world units
+CELL = 64.0
+# boxes over more cells than this go in the list of large items
+MAX_CELLS = 256
+
+
+class Grid_Index():
+    def __init__(self, cell=CELL, max_cells=MAX_CELLS):
+        self.cell = float(cell)
+        self.max_cells = max_cells
+        # (cx, cy): set of items
+        self.cells = {}
+        self.large = set()
+        # item: (box, order, cells it is listed in or None when large)
+        self.items = {}
+
+    def cell_range(self, x0, y0, x1, y1):
+        c = self.cell
+        return int(floor(x0/c)), int(floor(y0/c)), int(floor(x1/c)), int(floor(y1/c))
+
+    def insert(self, item, box, order):
+        '''lists item with its (x0, y0, x1, y1) box, or None when it has no
+        extent yet. Items with a higher order are on top.'''
+        self.remove(item)
+        keys = ()
+        if box is not None:
+            cx0, cy0, cx1, cy1 = self.cell_range(*box)
+            if (cx1 - cx0 + 1)*(cy1 - cy0 + 1) > self.max_cells:
+                keys = None
+                self.large.add(item)
+            else:
+                keys = [(cx, cy) for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1)]
+                for key in keys:
+                    self.cells.setdefault(key, set()).add(item)
+        self.items[item] = (box, order, keys)
+
+    def move(self, item, box):
+        '''lists item again after its box changed, keeping its order'''
+        self.insert(item, box, self.items[item][1])
+
+    def remove(self, item):
+        entry = self.items.pop(item, None)
+        if entry is None:
+            return
+        keys = entry[2]
+        if keys is None:
+            self.large.discard(item)
+            return
+        for key in keys:
+            items = self.cells[key]
+            items.discard(item)
+            if not items:
+                del self.cells[key]
+
+    def query(self, x, y, pad=0):
+        '''the items whose box is within pad of (x, y), topmost first'''
+        cx0, cy0, cx1, cy1 = self.cell_range(x - pad, y - pad, x + pad, y + pad)
+        if (cx1 - cx0 + 1)*(cy1 - cy0 + 1) > len(self.cells):
+            found = self.items
+        else:
+            found = set(self.large)
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    found.update(self.cells.get((cx, cy), ()))
+        hits = []
+        for item in found:
+            box, order, keys = self.items[item]
+            if box is not None and box[0] - pad <= x <= box[2] + pad and box[1] - pad <= y <= box[3] + pad:
+                hits.append((order, item))
+        hits.sort(key=lambda hit: hit[0], reverse=True)
+        return [item for order, item in hits]
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+
+def test_grid_index():
+    index = Grid_Index(cell=10, max_cells=16)
+    index.insert('low', (0, 0, 25, 25), 0)
+    index.insert('high', (20, 20, 30, 30), 1)
+    index.insert('huge', (-1000, -1000, 1000, 1000), 2)
+    index.insert('empty', None, 3)
+    assert index.query(22, 22) == ['huge', 'high', 'low']
+    assert index.query(5, 5) == ['huge', 'low']
+    assert index.query(31, 31) == ['huge'] and index.query(31, 31, pad=2) == ['huge', 'high']
+    index.move('low', (100, 100, 110, 110))
+    assert index.query(5, 5) == ['huge'] and index.query(105, 105) == ['huge', 'low']
+    index.remove('huge')
+    index.remove('high')
+    assert index.query(22, 22) == [] and len(index) == 2 and 'low' in index
+    assert index.query(105, 105, pad=5000) == ['low']
+    assert sorted(index.cells) == [(10, 10), (10, 11), (11, 10), (11, 11)]
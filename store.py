@@ -0,0 +1,186 @@
+'''Keeps images that are too big for memory in a scratch file, cut into
+square tiles. Only a bounded number of tiles is held in memory, the least
+recently used ones go back to the file first, so memory use stays the same
+however big the image is. Filters run on it one band of rows at a time.'''
+import os
+import tempfile
+import threading
+import collections
+import numpy as np
+import imaging
+import tiling
+
+# side of a tile in pixels
+TILE = 256
+# tiles kept in memory, 48 MB of 3 channel tiles
+CACHE_TILES = 256
+# images with more pixels than this are loaded into a store
+OUT_OF_CORE_PIXELS = 64*2**20
+# about how many pixels of a band a filter gets at once
+BAND_PIXELS = 2**22
+# not /dev/shm, that is memory too
+SCRATCH_DIR = None
+
+
+class Tile_Store():
+    def __init__(self, width, height, channels=3, cache_tiles=CACHE_TILES, dir=SCRATCH_DIR):
+        self.w = width
+        self.h = height
+        self.channels = channels
+        self.rows = -(-height/TILE)
+        self.cols = -(-width/TILE)
+        self.cache_tiles = cache_tiles
+        fd, self.path = tempfile.mkstemp(prefix='tiles', dir=dir)
+        os.close(fd)
+        self.file = np.memmap(self.path, dtype=np.uint8, mode='w+',
+                              shape=(self.rows, self.cols, TILE, TILE, channels))
+        self.cache = collections.OrderedDict()
+        self.dirty = set()
+        # the view reads while a filter writes
+        self.lock = threading.RLock()
+
+    def width(self):
+        return self.w
+
+    def height(self):
+        return self.h
+
+    def tile(self, ty, tx, load=True):
+        '''the cached (TILE, TILE, channels) array of a tile, read from the
+        file unless load is False because it is about to be overwritten'''
+        key = (ty, tx)
+        t = self.cache.pop(key, None)
+        if t is None:
+            while len(self.cache) >= self.cache_tiles:
+                self.evict()
+            if load:
+                t = np.array(self.file[ty, tx])
+            else:
+                t = np.empty((TILE, TILE, self.channels), dtype=np.uint8)
+        self.cache[key] = t
+        return t
+
+    def evict(self):
+        key, t = self.cache.popitem(last=False)
+        if key in self.dirty:
+            self.file[key] = t
+            self.dirty.discard(key)
+
+    def tiles(self, x0, y0, x1, y1):
+        '''yields (ty, tx, inside, outside) for every tile overlapping the
+        region, where inside slices the tile and outside the region'''
+        for ty in range(y0/TILE, -(-y1/TILE)):
+            top = max(y0, ty*TILE)
+            bottom = min(y1, (ty + 1)*TILE)
+            for tx in range(x0/TILE, -(-x1/TILE)):
+                left = max(x0, tx*TILE)
+                right = min(x1, (tx + 1)*TILE)
+                inside = (slice(top - ty*TILE, bottom - ty*TILE), slice(left - tx*TILE, right - tx*TILE))
+                outside = (slice(top - y0, bottom - y0), slice(left - x0, right - x0))
+                yield ty, tx, inside, outside
+
+    def read(self, x0=0, y0=0, x1=None, y1=None, step=1):
+        '''a copy of the (y1 - y0, x1 - x0, channels) region, keeping every
+        step-th pixel. Only the kept pixels are copied out of each tile, so
+        a sample of a huge image takes only the memory of the sample.'''
+        x1 = self.w if x1 is None else x1
+        y1 = self.h if y1 is None else y1
+        out = np.empty((-(-(y1 - y0)/step), -(-(x1 - x0)/step), self.channels), dtype=np.uint8)
+        with self.lock:
+            for ty, tx, inside, outside in self.tiles(x0, y0, x1, y1):
+                rows = strided(inside[0], outside[0], step)
+                cols = strided(inside[1], outside[1], step)
+                if rows and cols:
+                    out[rows[1], cols[1]] = self.tile(ty, tx)[rows[0], cols[0]]
+        return out
+
+    def write(self, x0, y0, colors):
+        y1 = y0 + colors.shape[0]
+        x1 = x0 + colors.shape[1]
+        with self.lock:
+            for ty, tx, inside, outside in self.tiles(x0, y0, x1, y1):
+                whole = (inside[0].stop - inside[0].start == TILE and
+                         inside[1].stop - inside[1].start == TILE)
+                self.tile(ty, tx, load=not whole)[inside] = colors[outside]
+                self.dirty.add((ty, tx))
+
+    def flush(self):
+        with self.lock:
+            for key in self.dirty:
+                self.file[key] = self.cache[key]
+            self.dirty.clear()
+            self.file.flush()
+
+    def memory(self):
+        '''bytes of tiles held in memory'''
+        return len(self.cache)*TILE*TILE*self.channels
+
+    def band_rows(self):
+        '''rows per band, whole tile rows of about BAND_PIXELS'''
+        return max(BAND_PIXELS/self.w/TILE, 1)*TILE
+
+    def close(self):
+        if self.file is not None:
+            self.file = None
+            self.cache.clear()
+            os.remove(self.path)
+
+    def __del__(self):
+        self.close()
+
+    def __repr__(self):
+        return 'Tile_Store(%s, %s)' % (self.w, self.h)
+
+
+def strided(inside, outside, step):
+    '''(inside, outside) slices of the part of a tile span that lands on
+    every step-th position of the region, outside counted in kept pixels,
+    or None when none of it does'''
+    skip = -outside.start % step
+    start = outside.start + skip
+    if start >= outside.stop:
+        return None
+    n = -(-(outside.stop - start)/step)
+    return slice(inside.start + skip, inside.stop, step), slice(start/step, start/step + n)
+
+
+def run(func, src, dst, args=(), kwargs={}, progress=None, band=None, parallel=True):
+    '''applies func to the store src like tiling.run, writing into the store
+    dst. Only one band plus its halo is read at a time. band is called with
+    (y0, y1) once rows y0..y1 of dst are written. parallel is passed on to
+    tiling.run for each band.'''
+    h = src.height()
+    rows = tiling.halo(func, args, kwargs)
+    if rows is None:
+        # the filter needs the whole image
+        dst.write(0, 0, func(src.read(), *args, **kwargs))
+        spans = [(0, h)]
+    else:
+        step = src.band_rows()
+        spans = [(y, min(y + step, h)) for y in range(0, h, step)]
+    for y0, y1 in spans:
+        if rows is not None:
+            top = max(y0 - rows, 0)
+            bottom = min(y1 + rows, h)
+            out = tiling.run(func, src.read(0, top, src.width(), bottom), args, kwargs,
+                             parallel=parallel)
+            dst.write(0, y0, out[y0 - top:y1 - top])
+        if progress:
+            progress(y1)
+        if band:
+            band(y0, y1)
+    return dst
+
+
+def test_store():
+    src = np.random.randint(0, 256, (700, 600, 3)).astype(np.uint8)
+    s = Tile_Store(600, 700, cache_tiles=3)
+    s.write(0, 0, src)
+    assert len(s.cache) == 3 and (s.read() == src).all()
+    assert (s.read(100, 250, 400, 600, step=3) == src[250:600:3, 100:400:3]).all()
+    d = Tile_Store(600, 700, cache_tiles=3)
+    s.band_rows = lambda: TILE
+    assert (run(imaging.median, s, d, (2,)).read() == imaging.median(src, 2)).all()
+    path = s.path
+    s.close()
+    assert not os.path.exists(path)
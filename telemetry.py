@@ -0,0 +1,146 @@
+'''Numbers about filter jobs: how long they waited in the queue, how long
+each stage took, how many pixels per second they did and how much memory
+the process peaked at. The last records can be queried, and every record
+can also be written to a file as a line of JSON.'''
+import os
+import json
+import time
+import tempfile
+import threading
+import resource
+import collections
+import contextlib
+
+# records kept for querying
+KEEP = 1000
+
+
+def reset_peak_memory():
+    '''restarts the resident set high water mark, where Linux allows it'''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except IOError:
+        return False
+
+
+def peak_memory():
+    '''peak resident set in bytes'''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])*1024
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+
+class Job_Record():
+    def __init__(self, label):
+        self.label = label
+        self.state = 'new'
+        self.queued = None
+        self.started = None
+        self.finished = None
+        self.pixels = 0
+        # (name, seconds) in the order they ran
+        self.stages = []
+        self.peak_memory = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.stages.append((name, time.time() - start))
+
+    def wait(self):
+        if self.queued is None or self.started is None:
+            return None
+        return self.started - self.queued
+
+    def wall(self):
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def pixels_per_second(self):
+        wall = self.wall()
+        if not wall or not self.pixels:
+            return None
+        return self.pixels/wall
+
+    def as_dict(self):
+        return {
+            'label': self.label,
+            'state': self.state,
+            'queued': self.queued,
+            'wait': self.wait(),
+            'wall_time': self.wall(),
+            'pixels': self.pixels,
+            'pixels_per_second': self.pixels_per_second(),
+            'stages': [{'stage': name, 'wall_time': t} for name, t in self.stages],
+            'peak_memory': self.peak_memory,
+        }
+
+    def __repr__(self):
+        return 'Job_Record(%s, %s, wall=%s)' % (self.label, self.state, self.wall())
+
+
+class Telemetry():
+    def __init__(self, path=None, keep=KEEP):
+        '''path names a file to append a JSON line to for every record'''
+        self.path = path
+        self.records = collections.deque(maxlen=keep)
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        with self.lock:
+            self.records.append(record)
+            if self.path:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(record.as_dict(), sort_keys=True) + '\n')
+
+    def find(self, label=None, state=None):
+        with self.lock:
+            return [r for r in self.records
+                    if (label is None or r.label == label) and (state is None or r.state == state)]
+
+    def summary(self):
+        '''per label: jobs done, mean wait, mean wall time and mean pixels
+        per second'''
+        totals = {}
+        for r in self.find(state='done'):
+            totals.setdefault(r.label, []).append(r)
+        summary = {}
+        for label, records in totals.items():
+            rates = [r.pixels_per_second() for r in records if r.pixels_per_second()]
+            summary[label] = {
+                'jobs': len(records),
+                'wait': sum(r.wait() for r in records)/len(records),
+                'wall_time': sum(r.wall() for r in records)/len(records),
+                'pixels_per_second': sum(rates)/len(rates) if rates else None,
+            }
+        return summary
+
+
+def test_telemetry():
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    t = Telemetry(path)
+    r = Job_Record('sharpen')
+    r.queued = 1.0
+    r.started = 1.5
+    with r.stage('filter'):
+        r.pixels = 100
+    r.finished = 3.5
+    r.state = 'done'
+    t.add(r)
+    assert r.wait() == 0.5 and r.pixels_per_second() == 50
+    assert t.summary()['sharpen']['jobs'] == 1
+    line = json.loads(open(path).read())
+    assert line['stages'][0]['stage'] == 'filter'
+    os.remove(path)
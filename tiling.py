@@ -0,0 +1,233 @@
+'''Runs the whole image filters from imaging and lut on row bands in a pool
+of worker processes. Every band is read with the halo of neighbor rows its
+filter needs, so the stitched result is the same as filtering the whole
+image at once. Pixels are exchanged through memory mapped files in
+/dev/shm, so only the band bounds are pickled.'''
+import os
+import tempfile
+import threading
+import multiprocessing
+import numpy as np
+import buffers
+import imaging
+import lut
+import pipeline
+
+# images smaller than this are not worth starting the pool for
+MIN_PIXELS = 512*512
+# bands per worker, more bands even out the load between workers
+BANDS_PER_WORKER = 4
+# bands when streaming results without the pool
+STREAM_BANDS = 16
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+# seconds between checks for cancellation while waiting on the pool
+POLL = 0.1
+
+# how many rows above and below each filter reads, given its arguments
+HALOS = {
+    imaging.convolve: lambda constants, scale=1, offset=0, table=None: imaging.as_kernel(constants).shape[0]/2,
+    imaging.gaussian: lambda sigma, table=None: len(imaging.gaussian_kernel(sigma))/2,
+    imaging.box_blur: lambda radius=1, table=None, full_window=True: radius,
+    imaging.box_gaussian: lambda sigma, table=None: sum(imaging.box_radii(sigma)),
+    imaging.median: lambda radius=1: radius,
+    imaging.edges: lambda direction=False, table=None: 1,
+    lut.apply: lambda t: 0,
+    pipeline.run: lambda stages: pipeline_halo(stages),
+}
+
+_pool = None
+# bumped when a run stops early, bands queued for an older value are skipped
+generation = None
+lock = threading.Lock()
+# the shared copies of the source image, kept for the next run of that size
+scratch = buffers.Buffer_Pool()
+
+
+def start():
+    '''starts the worker processes. The pool forks, which copies only the
+    calling thread, so an app calls this once from its main thread before
+    it starts threads of its own. Until then, and after close, runs filter
+    their bands in the calling process.'''
+    global _pool, generation
+    with lock:
+        if _pool is None:
+            generation = multiprocessing.Value('l', 0)
+            _pool = multiprocessing.Pool(workers())
+
+
+def pool():
+    '''the worker pool, or None when it is not started'''
+    return _pool
+
+
+def workers():
+    return multiprocessing.cpu_count()
+
+
+def close():
+    global _pool
+    with lock:
+        old = _pool
+        _pool = None
+    if old is not None:
+        old.terminate()
+    scratch.trim(0)
+
+
+def halo(func, args=(), kwargs={}):
+    if func not in HALOS:
+        return None
+    return HALOS[func](*args, **kwargs)
+
+
+def pipeline_halo(stages):
+    '''each stage reads the halo of the one before it, so they add up'''
+    halos = [halo(*stage) for stage in stages]
+    if None in halos:
+        return None
+    return sum(halos)
+
+
+def bands(height, halo, count):
+    '''splits height rows into at most count bands of at least 2*halo rows'''
+    rows = max(-(-height/count), 2*halo, 1)
+    return [(y, min(y + rows, height)) for y in range(0, height, rows)]
+
+
+def shared_array(shape, dtype=np.uint8):
+    fd, path = tempfile.mkstemp(prefix='filter', dir=SHM_DIR)
+    os.close(fd)
+    return np.memmap(path, dtype=dtype, mode='w+', shape=shape), path
+
+
+def remove_shared(shared):
+    os.remove(shared[1])
+
+
+def run(func, src, args=(), kwargs={}, progress=None, band=None, parallel=True, focus=None):
+    '''applies func to the (h, w, c) array src like func(src, *args,
+    **kwargs), split over the worker pool when func has a known halo and
+    the image is big enough. progress is called with the number of rows
+    done so far. band is called with (y0, y1, out) as soon as rows y0..y1
+    of out are final, bands are filtered one after another in this process
+    when the pool is not used so they still stream in. focus returns the
+    row the user is looking at, or None, and bands nearest to it go first.
+    When progress or band raise, the bands still queued are skipped so no
+    stale bands keep the pool busy.'''
+    h = src.shape[0]
+    rows = halo(func, args, kwargs)
+    small = src.shape[0]*src.shape[1] < MIN_PIXELS
+    if rows is None or small or not parallel or workers() < 2 or pool() is None:
+        if rows is None or small or band is None:
+            out = func(src, *args, **kwargs)
+            if progress:
+                progress(h)
+            if band:
+                band(0, h, out)
+            return out
+        out = np.empty_like(src)
+        todo = bands(h, rows, STREAM_BANDS)
+        while todo:
+            # asked again for every band, so scrolling moves the work along
+            y0, y1 = nearest(todo, focus and focus())
+            todo.remove((y0, y1))
+            out[y0:y1] = filter_band(func, src, y0, y1, rows, args, kwargs)
+            if progress:
+                progress(h - sum(b - a for a, b in todo))
+            band(y0, y1, out)
+        return out
+
+    source = scratch.take(('shared', src.shape), lambda: shared_array(src.shape))
+    shared_src, src_path = source
+    shared_dst, dst_path = shared_array(src.shape)
+    finished = False
+    try:
+        shared_src[:] = src
+        shared_src.flush()
+        spans = bands(h, rows, workers()*BANDS_PER_WORKER)
+        row = focus and focus()
+        if row is not None:
+            spans.sort(key=lambda span: distance(span, row))
+        run_id = generation.value
+        tasks = [(src_path, dst_path, src.shape, y0, y1, rows, func, args, kwargs, run_id)
+                 for y0, y1 in spans]
+        wait_for(tasks, shared_dst, progress, band)
+        finished = True
+        return shared_dst
+    finally:
+        # after a stop, bands already started may still read the source, so
+        # it is only given back when every band is in. The mappings stay
+        # valid after the files are unlinked, the result is handed out so
+        # its file is not reused.
+        if finished:
+            scratch.give(('shared', src.shape), source, shared_src.nbytes, remove_shared)
+        else:
+            remove_shared(source)
+        os.remove(dst_path)
+
+
+def wait_for(tasks, dst, progress, band):
+    '''runs tasks on the pool and calls back as their bands come in.
+    progress is also called while waiting, so cancelling is noticed even
+    when bands are slow. When a callback or a band raises, the bands still
+    queued are skipped, so they do not hold up the next run.'''
+    finished = False
+    try:
+        results = pool().imap_unordered(run_band, tasks)
+        done = 0
+        for i in range(len(tasks)):
+            while True:
+                try:
+                    y0, y1 = results.next(POLL)
+                    break
+                except multiprocessing.TimeoutError:
+                    if progress:
+                        progress(done)
+            done += y1 - y0
+            if progress:
+                progress(done)
+            if band:
+                band(y0, y1, dst)
+        finished = True
+    finally:
+        if not finished:
+            with generation.get_lock():
+                generation.value += 1
+
+
+def distance(span, row):
+    y0, y1 = span
+    return max(y0 - row, row - y1 + 1, 0)
+
+
+def nearest(spans, row):
+    if row is None:
+        return spans[0]
+    return min(spans, key=lambda span: distance(span, row))
+
+
+def filter_band(func, src, y0, y1, rows, args, kwargs, x0=0, x1=None):
+    '''rows y0..y1 (and columns x0..x1) of func applied to src, reading only
+    the halo around them. The kernels are square, so the halo is the same
+    sideways.'''
+    if x1 is None:
+        x1 = src.shape[1]
+    top = max(y0 - rows, 0)
+    bottom = min(y1 + rows, src.shape[0])
+    left = max(x0 - rows, 0)
+    right = min(x1 + rows, src.shape[1])
+    out = func(np.array(src[top:bottom, left:right]), *args, **kwargs)
+    return out[y0 - top:y1 - top, x0 - left:x1 - left]
+
+
+def run_band(task):
+    '''runs in a worker. Filters rows y0..y1 plus the halo and writes only
+    y0..y1 of the result, unless the run stopped while the band was queued.'''
+    src_path, dst_path, shape, y0, y1, rows, func, args, kwargs, run_id = task
+    if generation.value != run_id:
+        return y0, y1
+    src = np.memmap(src_path, dtype=np.uint8, mode='r', shape=shape)
+    dst = np.memmap(dst_path, dtype=np.uint8, mode='r+', shape=shape)
+    dst[y0:y1] = filter_band(func, src, y0, y1, rows, args, kwargs)
+    dst.flush()
+    return y0, y1
@@ -4,8 +4,11 @@ from PySide.QtOpenGL import *
 from OpenGL.GLU import *
 from OpenGL.GL import *
 from model import Transform2d, Color, Point, Shape, Line, Rectangle, Square, Ellipse, Circle, Triangle, Image
+from model import Shape_Columns, TYPES
 import numpy as np
 import copy
+import imaging
+import store
 
 
 class ColorIndicator(QWidget):
@@ -91,17 +94,47 @@ class DrawWidget(QWidget):
             self.shape_types_map[tn] = t
 
         self.image = QImage()
+        self.pyramid = None
+        # a small filtered proxy drawn over the image until the next
+        # set_image, the image itself stays what filters read
+        self.preview = None
 
     def paintEvent(self, event):
         painter = QPainter(self)
-        tl = self.viewport.to_view(self.image.to_world(Point(-self.image.w, +self.image.h)))
-        tr = self.viewport.to_view(self.image.to_world(Point(+self.image.w, +self.image.h)))
-        br = self.viewport.to_view(self.image.to_world(Point(+self.image.w, -self.image.h)))
-        bl = self.viewport.to_view(self.image.to_world(Point(-self.image.w, -self.image.h)))
-        
-        # scale image to viewport transformation
-        draw_image = self.image.qimage.scaled(tr.x - tl.x, tr.y - br.y)
-        painter.drawImage(QPoint(*bl.xy()), draw_image)
+        tl, tr, br, bl = self.viewport.to_view_points(
+            self.image.to_world_points(self.image.bounding_box().corner_array()))
+        w = tr[0] - tl[0]
+        h = tr[1] - br[1]
+
+        # only the part of the image inside the widget is drawn
+        target = QRectF(bl[0], bl[1], w, h).intersected(QRectF(self.rect()))
+        if target.isEmpty():
+            return
+        shown = self.image.qimage if self.preview is None else self.preview
+        if self.pyramid is None or self.pyramid.qimage is not shown:
+            if isinstance(shown, store.Tile_Store):
+                self.pyramid = Store_Pyramid(shown)
+            else:
+                self.pyramid = Pyramid(shown)
+        self.pyramid.draw(painter, target, QRectF(bl[0], bl[1], w, h), self.viewport.s)
+
+    def visible_region(self, width, height):
+        '''the (x0, y0, x1, y1) pixels of a width x height image stretched
+        over the background image that are inside the view, or None when
+        the image is scrolled out of sight'''
+        left = self.image.center.x - self.image.w
+        top = self.image.center.y - self.image.h
+        sx = float(width)/self.image.fullw
+        sy = float(height)/self.image.fullh
+        view_w = self.size().width()/self.viewport.s
+        view_h = self.size().height()/self.viewport.s
+        x0 = max(int((self.viewport.x - left)*sx), 0)
+        y0 = max(int((self.viewport.y - top)*sy), 0)
+        x1 = min(int(np.ceil((self.viewport.x + view_w - left)*sx)), width)
+        y1 = min(int(np.ceil((self.viewport.y + view_h - top)*sy)), height)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return x0, y0, x1, y1
 
     def update_color_indicator(self, r, g, b, a):
         self.parent().ui.w_color_indicator.update_color(r, g, b, a)
@@ -154,10 +187,11 @@ class DrawWidget(QWidget):
 
             found_shape = False
             if not handle_clicked:
-                for s in reversed(self.model.shapes):
+                tolerance = 4/self.controller.zoom_amount()
+                for s in self.model.shapes_at(self.press_pos, pad=tolerance):
                     if s.type == 'line':
-                        print 'tolerance', 4/self.controller.zoom_amount()
-                        is_inside = s.is_inside(self.press_pos, tolerance=4/self.controller.zoom_amount())
+                        print 'tolerance', tolerance
+                        is_inside = s.is_inside(self.press_pos, tolerance=tolerance)
                     else:
                         is_inside = s.is_inside(self.press_pos)
 
@@ -195,6 +229,7 @@ class DrawWidget(QWidget):
                 self.reshape_map[self.controller.selected_shape.type]()
             else:
                 self.controller.selected_shape.center = self.move_pos - self.d_vec
+            self.model.update_shape(self.controller.selected_shape)
         self.canvas.updateGL()
 
     def mouseReleaseEvent(self, event):
@@ -206,11 +241,15 @@ class DrawWidget(QWidget):
             if self.controller.selected_shape.type == 'rectangle' or self.controller.draw_mode == 'ellipse':
                 self.controller.selected_shape.w = abs(self.controller.selected_shape.w)
                 self.controller.selected_shape.h = abs(self.controller.selected_shape.h)
+            self.model.update_shape(self.controller.selected_shape)
         self.finish(self.to_screen(event.pos().x(), event.pos().y()))
 
     def draw(self):
-        for shape in self.model.shapes:
-            self.draw_map[shape.type](shape)
+        if isinstance(self.model.shapes, Shape_Columns):
+            self.draw_columns(self.model.shapes)
+        else:
+            for shape in self.model.shapes:
+                self.draw_map[shape.type](shape)
 
         if self.move_pos:
             self.draw_map[self.controller.draw_mode](self.draw_shape, pos=self.move_pos)
@@ -237,13 +276,46 @@ class DrawWidget(QWidget):
 
             # Draw rotation handle if needed
             if self.controller.selected_shape.type != 'line':
-                obb = shape.bounding_box()
+                obb = outline.bounding_box()
                 rot_handle_x = max(obb.tl().x, obb.tr().x)
                 rot_handle_y = (obb.tr().y + obb.br().y)/2
                 rot_handle_point = outline.to_world(Point(rot_handle_x, rot_handle_y)) + Point(15, 0)
                 self.rot_handle = Circle(Color(1, 0, 0), rot_handle_point, 5)
                 self.draw_circle(self.rot_handle, fixed_size=True)
 
+    def draw_columns(self, columns):
+        '''draws the saved shapes straight from the arrays, with the points
+        of every shape taken to the view in one product and no proxies'''
+        n = len(columns)
+        if not n:
+            return
+        points = self.viewport.to_view_points(columns.world_points().reshape(-1, 2))
+        points = points.reshape(n, 4, 2).tolist()
+        zoom = self.controller.zoom_amount()
+        # unset extents read as 0, which the guards below skip like None
+        extents = np.nan_to_num(columns.extent[:n]).tolist()
+        rows = zip(columns.kind[:n].tolist(), columns.rgba[:n].tolist(),
+                   columns.rotation[:n].tolist(), extents, points)
+        for kind, rgba, rotation, (w, h), p in rows:
+            kind = TYPES[kind]
+            color = Color(*rgba)
+            if kind == 'rectangle' or kind == 'square':
+                if w and (h or kind == 'square'):
+                    draw_quad(color, *p)
+            elif kind == 'triangle':
+                draw_triangle(color, *p[:3])
+            elif kind == 'line':
+                if not np.isnan(p[1][0]):
+                    draw_line(color, p[0], p[1])
+            elif kind == 'ellipse':
+                if w and h:
+                    x, y = p[0]
+                    rot = {'angle': rotation, 'x': x, 'y': y}
+                    draw_ellipse(color, x, y, abs(w)*zoom, abs(h)*zoom, fill=True, rot=rot)
+            elif w:
+                x, y = p[0]
+                draw_ellipse(color, x, y, w*zoom, w*zoom, fill=True)
+
     def finish(self, pos):
         if self.draw_shape:
             save_shape = False
@@ -314,13 +386,8 @@ class DrawWidget(QWidget):
         if not (shape.center and shape.w and shape.h):
             return
 
-        draw_quad(
-            shape.color,
-            self.viewport.to_view(shape.to_world(Point(-shape.w, +shape.h))).xy(),
-            self.viewport.to_view(shape.to_world(Point(+shape.w, +shape.h))).xy(),
-            self.viewport.to_view(shape.to_world(Point(+shape.w, -shape.h))).xy(),
-            self.viewport.to_view(shape.to_world(Point(-shape.w, -shape.h))).xy(),
-            fill=fill)
+        corners = shape.to_world_points(shape.bounding_box().corner_array())
+        draw_quad(shape.color, *self.viewport.to_view_points(corners), fill=fill)
 
     def reshape_rectangle(self):
         self.bounding_box_reshape(self.controller.selected_shape)
@@ -346,14 +413,9 @@ class DrawWidget(QWidget):
         if not (shape.center and shape.size):
             return
 
-        draw_quad(
-            shape.color,
-            self.viewport.to_view(shape.to_world(Point(-shape.size, +shape.size))).xy(),  # top left corner
-            self.viewport.to_view(shape.to_world(Point(+shape.size, +shape.size))).xy(),  # top right corner
-            self.viewport.to_view(shape.to_world(Point(+shape.size, -shape.size))).xy(),  # bottom right corner
-            self.viewport.to_view(shape.to_world(Point(-shape.size, -shape.size))).xy(),  # bottom left corner
-            fill=fill
-        )
+        # top left, top right, bottom right and bottom left corners
+        corners = shape.to_world_points(shape.bounding_box().corner_array())
+        draw_quad(shape.color, *self.viewport.to_view_points(corners), fill=fill)
 
     def reshape_square(self):
         move_pos = self.controller.selected_shape.to_object(self.move_pos)
@@ -441,11 +503,8 @@ class DrawWidget(QWidget):
 
     def draw_triangle(self, shape, pos=None, fill=True):
         # convert back to world
-        draw_triangle(shape.color,
-                      self.viewport.to_view(shape.to_world(shape.p1)).xy(),
-                      self.viewport.to_view(shape.to_world(shape.p2)).xy(),
-                      self.viewport.to_view(shape.to_world(shape.p3)).xy(),
-                      fill=fill)
+        points = shape.to_world_points([p.vec() for p in shape.points()])
+        draw_triangle(shape.color, *self.viewport.to_view_points(points), fill=fill)
 
     def reshape_triangle(self):
         p1 = self.controller.selected_shape.to_world(self.controller.selected_shape.p1)
@@ -499,6 +558,17 @@ class DrawWidget(QWidget):
 
     def set_image(self, image):
         self.image.qimage = image
+        self.preview = None
+        # filters write into images in place, so even the same image
+        # needs new levels
+        self.pyramid = None
+
+    def show_preview(self, image):
+        '''draws image stretched over the background image, without making
+        it the image filters read'''
+        self.preview = image
+        self.pyramid = None
+        self.update()
 
     def draw_image(self, image=None):
         # self.canvas.set_image(image)
@@ -572,6 +642,62 @@ class DrawWidget(QWidget):
             shape.center += shape.to_world(dp, trans=False)
 
 
+class Pyramid():
+    '''scaled down copies of an image, one per zoom level, each made the
+    first time that zoom is drawn. Zooming in needs no copy, the visible
+    part of the image itself is scaled while drawing.'''
+    def __init__(self, qimage):
+        self.qimage = qimage
+        self.levels = {}
+
+    def level(self, zoom, w, h):
+        '''the image scaled to w x h at zoom'''
+        w = int(round(w))
+        h = int(round(h))
+        if w >= self.qimage.width() or h >= self.qimage.height():
+            return self.qimage
+        if zoom not in self.levels:
+            # scale from the next bigger level, it is closer than the image
+            bigger = [z for z in self.levels if z > zoom]
+            source = self.levels[min(bigger)] if bigger else self.qimage
+            self.levels[zoom] = source.scaled(w, h, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        return self.levels[zoom]
+
+    def draw(self, painter, target, rect, zoom):
+        '''draws the part of the image that lands on target when all of it
+        is drawn on rect'''
+        level = self.level(zoom, rect.width(), rect.height())
+        sx = level.width()/rect.width()
+        sy = level.height()/rect.height()
+        source = QRectF((target.x() - rect.x())*sx, (target.y() - rect.y())*sy, target.width()*sx, target.height()*sy)
+        painter.drawImage(target, level, source)
+
+
+class Store_Pyramid(Pyramid):
+    '''draws a store.Tile_Store, which never is in memory as a whole, by
+    reading only the pixels in sight. Zoomed out it reads every n-th pixel.
+    The last piece read is kept for repaints that do not scroll.'''
+    def __init__(self, qimage):
+        Pyramid.__init__(self, qimage)
+        self.piece = None
+
+    def draw(self, painter, target, rect, zoom):
+        sx = self.qimage.width()/rect.width()
+        sy = self.qimage.height()/rect.height()
+        x0 = max(int((target.x() - rect.x())*sx), 0)
+        y0 = max(int((target.y() - rect.y())*sy), 0)
+        x1 = min(int(np.ceil((target.right() - rect.x())*sx)), self.qimage.width())
+        y1 = min(int(np.ceil((target.bottom() - rect.y())*sy)), self.qimage.height())
+        step = max(int(min(sx, sy)), 1)
+        key = (x0, y0, x1, y1, step)
+        if self.piece is None or self.piece[0] != key:
+            colors = self.qimage.read(x0, y0, x1, y1, step)
+            piece = QImage(colors.shape[1], colors.shape[0], QImage.Format_ARGB32)
+            self.piece = key, imaging.write_color(piece, colors)
+        piece = self.piece[1]
+        painter.drawImage(target, piece, QRectF(0, 0, piece.width(), piece.height()))
+
+
 class Viewport():
     def __init__(self, world_w, world_h):
         self.world_w = world_w
@@ -582,21 +708,36 @@ class Viewport():
     def set_offset(self, x, y):
         self.x = x
         self.y = y
+        self.transforms = None
 
     def set_scale(self, s):
         self.s = s
+        self.transforms = None
+
+    def view_transforms(self):
+        '''(world to view, view to world) Transform2d, kept until the offset
+        or the scale is set again'''
+        if self.transforms is None:
+            to_view = Transform2d()
+            to_view.scale(self.s, self.s)
+            to_view.translate(Point(-self.x, -self.y))
+            to_world = Transform2d()
+            to_world.translate(Point(self.x, self.y))
+            to_world.scale(1/self.s, 1/self.s)
+            self.transforms = (to_view, to_world)
+        return self.transforms
 
     def to_view(self, p):
-        t = Transform2d()
-        t.scale(self.s, self.s)
-        t.translate(Point(-self.x, -self.y))
-        return t.transform(p)
+        return self.view_transforms()[0].transform(p)
 
     def to_world(self, p):
-        t = Transform2d()
-        t.translate(Point(self.x, self.y))
-        t.scale(1/self.s, 1/self.s)
-        return t.transform(p)
+        return self.view_transforms()[1].transform(p)
+
+    def to_view_points(self, points):
+        return self.view_transforms()[0].transform_points(points)
+
+    def to_world_points(self, points):
+        return self.view_transforms()[1].transform_points(points)
 
 
 def draw_line(color, p1, p2):